@@ -0,0 +1,363 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from argparse import ArgumentParser
+import heapq
+from itertools import accumulate, islice
+import os
+import random
+import re
+from string import punctuation
+import tempfile
+import time
+from typing import Dict, Generator, List, Tuple
+from models.index import InvertedIndex
+from models.parser import Parser
+from models.posting_list import PostingList, PostingType
+from models.ranker import Ranker, RankerFactory, RankingMethod
+from models.spimi import BlockFormat, Spimi
+from models.tokenizer import Tokenizer
+
+
+def load_posting_lists(index:InvertedIndex, ranker:Ranker) -> Dict[str, PostingList]:
+    if index.skip_blocks:
+        return {term: ranker.load_posting_list_skip_bytes(data).decode() for term, data in index.fetch_posting_lists(list(index.lexicon)).items()}
+    load_posting_list = ranker.load_posting_list_bytes if index.compressed else ranker.load_posting_list
+    return {term: load_posting_list(data) for term, data in index.fetch_posting_lists(list(index.lexicon)).items()}
+
+
+def posting_encoding_benchmark(search_index:str):
+    """
+    Compare the size and decoding speed of the text and the variable byte posting lists of an index, in either encoding
+
+    :param search_index: path to the index file, it must have a lexicon
+    :return: None
+    """
+    index = InvertedIndex(None, output_path=search_index)
+    ranker = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']))
+    ranker.load_metadata(index.metadata)
+
+    posting_lists = load_posting_lists(index, ranker)
+    postings = sum(len(posting_list) for posting_list in posting_lists.values())
+    text_lines = [ranker.term_repr(posting_list) for posting_list in posting_lists.values()]
+    compressed_lines = [ranker.term_bytes(posting_list) for posting_list in posting_lists.values()]
+
+    start = time.perf_counter()
+    for line in text_lines:
+        ranker.load_posting_list(line)
+    text_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in compressed_lines:
+        ranker.load_posting_list_bytes(data)
+    compressed_time = time.perf_counter() - start
+
+    text_size = sum(len(line.encode('utf-8')) for line in text_lines)
+    compressed_size = sum(len(data) for data in compressed_lines)
+
+    print(search_index)
+    print(f"terms: {len(posting_lists)}, postings: {postings}")
+    print(f"text posting lists: {round(text_size/1e6, 3)} MB, decoded at {round(postings/text_time)} postings/s ({round(text_size/1e6/text_time, 3)} MB/s)")
+    print(f"vbyte posting lists: {round(compressed_size/1e6, 3)} MB, decoded at {round(postings/compressed_time)} postings/s ({round(compressed_size/1e6/compressed_time, 3)} MB/s)")
+    print(f"size ratio: {round(compressed_size/text_size, 3)}")
+
+
+def load_queries(queries_file:str) -> List[str]:
+    # the queries of a relevance file, the lines starting with "Q:"
+    with open(queries_file) as file:
+        return [line.split(':', 1)[1].strip() for line in file if line.startswith('Q:')]
+
+
+def dynamic_pruning_benchmark(search_index:str, queries_file:str, n:int):
+    """
+    Compare the exhaustive BM25 top n search with the MaxScore dynamic pruning, the results of both must be the same
+
+    :param search_index: path to a BM25 index file
+    :param queries_file: relevance file with the queries
+    :param n: number of results of each query
+    :return: None
+    """
+    index = InvertedIndex(None, output_path=search_index)
+    tokenizer = Tokenizer(index.metadata['min_token_length'], index.metadata['stop_words'], index.metadata['language'])
+    exhaustive_ranker = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']))
+    pruning_ranker = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']), dynamic_pruning=True)
+
+    queries = [tokenizer.tokenize(query) for query in load_queries(queries_file)]
+    # read every posting list once so the files are in the page cache
+    for tokens in queries:
+        index.search(tokens, n, exhaustive_ranker)
+
+    times = []
+    results = []
+    for ranker in (exhaustive_ranker, pruning_ranker):
+        ranker_results = []
+        start = time.perf_counter()
+        for tokens in queries:
+            # the posting lists are read and decoded by every query
+            index.posting_list_cache.clear()
+            ranker_results.append(index.search(tokens, n, ranker, show_score=True))
+        times.append(time.perf_counter() - start)
+        results.append(ranker_results)
+
+    mismatches = sum(1 for exhaustive, pruned in zip(*results) if exhaustive != pruned)
+    print(search_index)
+    print(f"queries: {len(queries)}, n: {n}")
+    print(f"exhaustive: {round(times[0]/len(queries)*1000, 3)} ms/query")
+    print(f"dynamic pruning: {round(times[1]/len(queries)*1000, 3)} ms/query")
+    print(f"queries with different results: {mismatches}")
+
+
+def reference_tokenize(tokenizer:Tokenizer, text:str) -> List[str]:
+    # the character by character tokenizer that Tokenizer.tokenize() replaced, with the same settings and without its stemming cache
+    no_ponctuation = map(lambda w: " " if w in punctuation else w, text)
+    lowered = "".join(no_ponctuation).lower()
+    tokens = list(re.findall(r'\S+|\t|\n', lowered))
+    if tokenizer.min_token_length != None:
+        tokens = filter(lambda n: len(n) >= tokenizer.min_token_length, tokens)
+    if tokenizer.stop_words != None:
+        tokens = filter(lambda n: n not in tokenizer.stop_words, tokens)
+    if tokenizer.snow_stemmer != None:
+        tokens = [tokenizer.snow_stemmer.stem(token) for token in tokens]
+    return list(tokens)
+
+
+def tokenizer_benchmark(documents:str, limit:int, min_token_length:int, stop_words:str, language:str):
+    """
+    Check that Tokenizer.tokenize() gives the same tokens as the character by character tokenizer over a sample of the documents, and measure the speed of both
+
+    :param documents: documents file, in the format read by the indexer
+    :param limit: number of documents of the sample
+    :return: None
+    """
+    texts = [text for _, text in islice(Parser(documents, 'review_id', ['review_headline', 'review_body']).parse('\t'), limit)]
+
+    # without stemming, the part that changed
+    tokenizer = Tokenizer(min_token_length, stop_words)
+    start = time.perf_counter()
+    reference = [reference_tokenize(tokenizer, text) for text in texts]
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tokens = [tokenizer.tokenize(text) for text in texts]
+    fast_time = time.perf_counter() - start
+    different = sum(1 for expected, actual in zip(reference, tokens) if expected != actual)
+
+    # with stemming, the stems are cached by the tokenizer
+    stemming_tokenizer = Tokenizer(min_token_length, stop_words, language)
+    start = time.perf_counter()
+    stemmed_tokens = [stemming_tokenizer.tokenize(text) for text in texts]
+    stemming_time = time.perf_counter() - start
+    different += sum(1 for text, actual in zip(texts, stemmed_tokens) if reference_tokenize(stemming_tokenizer, text) != actual)
+
+    count = sum(len(document_tokens) for document_tokens in tokens)
+    print(documents)
+    print(f"documents: {len(texts)}, tokens: {count}")
+    print(f"character by character: {round(count/reference_time)} tokens/s")
+    print(f"translate and regex: {round(count/fast_time)} tokens/s")
+    print(f"translate and regex with stemming: {round(sum(len(document_tokens) for document_tokens in stemmed_tokens)/stemming_time)} tokens/s")
+    print(f"documents with different tokens: {different}")
+
+
+class ReferenceNode:
+    # node of the heap of the merge that Spimi.merge_entries() replaced
+    def __init__(self, term: str, posting_list: PostingList, block_id: int):
+        self.term = term
+        self.posting_list = posting_list
+        self.block_id = block_id
+
+    def __lt__(self, other):
+        return (self.term, self.block_id) < (other.term, other.block_id)
+
+
+def reference_merge(indexer:Spimi, files:List[str]) -> Generator[Tuple[str, PostingList], None, None]:
+    # the merge that Spimi.min_k_merge_generator() replaced, a node per line, list.pop(0) on the buffers and every line parsed when it enters the heap
+    def load_line(line):
+        if indexer.block_format == BlockFormat.BINARY:
+            return indexer.inverted_index.load_record(line, indexer.ranker)
+        return indexer.inverted_index.load(line, indexer.ranker)
+
+    buffer_size = max(indexer.merge_buffer_bytes // len(files), 8192)
+    generators = [indexer.file_generator(file, buffer_size) for file in files]
+    lines_buffer = [next(generator, []) for generator in generators]
+    heap = []
+    for i, lines in enumerate(lines_buffer):
+        if lines != []:
+            term, posting_list = load_line(lines.pop(0))
+            heap.append(ReferenceNode(term, posting_list, i))
+    heapq.heapify(heap)
+
+    while len(heap) > 0:
+        smallest_nodes = [heapq.heappop(heap)]
+        while len(heap) > 0 and heap[0].term == smallest_nodes[0].term:
+            smallest_nodes.append(heapq.heappop(heap))
+        yield (smallest_nodes[0].term, indexer.ranker.merge_posting_lists(indexer.posting_list_class, [node.posting_list for node in smallest_nodes]))
+
+        for node in smallest_nodes:
+            if lines_buffer[node.block_id] == []:
+                lines_buffer[node.block_id].extend(next(generators[node.block_id], []))
+            if lines_buffer[node.block_id] != []:
+                term, posting_list = load_line(lines_buffer[node.block_id].pop(0))
+                heapq.heappush(heap, ReferenceNode(term, posting_list, node.block_id))
+
+
+def merge_benchmark(blocks:int, documents_per_block:int, tokens_per_document:int, vocabulary:int, block_format:BlockFormat):
+    """
+    Write synthetic blocks with words taken from a Zipf distribution, check that Spimi.min_k_merge_generator() gives the same posting lists as the merge with a node per line,
+    and measure the speed of both and of the merge of the blocks into a run, which copies the terms found in a single block without decoding them
+
+    :param blocks: number of blocks
+    :param documents_per_block: number of documents of each block
+    :param tokens_per_document: number of tokens of each document
+    :param vocabulary: number of different words
+    :param block_format: format of the blocks
+    :return: None
+    """
+    generator = random.Random(0)
+    words = [f'term{i}' for i in range(vocabulary)]
+    cumulative_weights = list(accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        indexer = Spimi(RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY), PostingType.FREQUENCY, max_block_size=vocabulary + 1, auxiliary_dir=directory, block_format=block_format, merge_fan_in=0)
+        doc_id = 0
+        for _ in range(blocks):
+            for _ in range(documents_per_block):
+                indexer.add_document(doc_id, generator.choices(words, cum_weights=cumulative_weights, k=tokens_per_document))
+                doc_id += 1
+            indexer.flush_block()
+        files = [path for level in indexer.merge_levels for path in level]
+        size = sum(os.path.getsize(file) for file in files)
+
+        start = time.perf_counter()
+        reference = [(term, indexer.ranker.document_repr(posting_list)) for term, posting_list in reference_merge(indexer, files)]
+        reference_time = time.perf_counter() - start
+        start = time.perf_counter()
+        merged = [(term, indexer.ranker.document_repr(posting_list)) for term, posting_list in indexer.min_k_merge_generator(files)]
+        merge_time = time.perf_counter() - start
+        start = time.perf_counter()
+        indexer._write_run(files, f'{directory}/merged.run')
+        run_time = time.perf_counter() - start
+
+    print(f"blocks: {blocks} ({block_format.value}), size: {round(size / 2**20, 1)} MiB, documents: {doc_id}, terms: {len(merged)}")
+    for name, seconds in (("node per line", reference_time), ("lazy tuple entries", merge_time), ("lazy tuple entries to a run", run_time)):
+        print(f"{name}: {round(seconds, 3)} s, {round(len(merged) / seconds)} terms/s, {round(size / 2**20 / seconds, 1)} MiB/s")
+    print(f"terms with different posting lists: {sum(1 for expected, actual in zip(reference, merged) if expected != actual) + abs(len(reference) - len(merged))}")
+
+
+def parse_args():
+    arg_parser = ArgumentParser()
+    benchmarks = arg_parser.add_subparsers(dest="benchmark", required=True)
+
+    posting_encoding = benchmarks.add_parser("posting-encoding", help="Size and decoding speed of the text and variable byte posting lists")
+    posting_encoding.add_argument(
+        "--search-index",
+        dest="search_index",
+        help="Path to the index file",
+        required=True
+    )
+
+    dynamic_pruning = benchmarks.add_parser("dynamic-pruning", help="Speed of the BM25 top n search with and without the MaxScore dynamic pruning")
+    dynamic_pruning.add_argument(
+        "--search-index",
+        dest="search_index",
+        help="Path to a BM25 index file",
+        required=True
+    )
+    dynamic_pruning.add_argument(
+        "--queries",
+        dest="queries",
+        help="Relevance file with the queries, in the format of queries.relevance.txt",
+        default="queries.relevance.txt"
+    )
+    dynamic_pruning.add_argument(
+        "--n",
+        type=int,
+        dest="n_results",
+        help="Number of results of each query",
+        default=10
+    )
+
+    tokenizer = benchmarks.add_parser("tokenizer", help="Compare the tokens and the speed of the tokenizer with the character by character one")
+    tokenizer.add_argument(
+        "--documents",
+        dest="documents",
+        help="Documents file, in the format read by the indexer",
+        required=True
+    )
+    tokenizer.add_argument(
+        "--limit",
+        type=int,
+        dest="limit",
+        help="Number of documents of the sample",
+        default=10000
+    )
+    tokenizer.add_argument(
+        "--min-token-length",
+        type=int,
+        dest="min_token_length",
+        help="Minimum length of the tokens",
+        default=3
+    )
+    tokenizer.add_argument(
+        "--stop-words",
+        dest="stop_words",
+        help="Path to the file of stop words",
+        default="stop_words.txt"
+    )
+    tokenizer.add_argument(
+        "--language",
+        dest="language",
+        help="Language of the stemmer",
+        default="english"
+    )
+
+    merge = benchmarks.add_parser("merge", help="Compare the posting lists and the speed of the merge of the blocks with the merge with a node per line, over synthetic blocks")
+    merge.add_argument(
+        "--blocks",
+        type=int,
+        dest="blocks",
+        help="Number of blocks",
+        default=1000
+    )
+    merge.add_argument(
+        "--documents-per-block",
+        type=int,
+        dest="documents_per_block",
+        help="Number of documents of each block",
+        default=20
+    )
+    merge.add_argument(
+        "--tokens-per-document",
+        type=int,
+        dest="tokens_per_document",
+        help="Number of tokens of each document",
+        default=50
+    )
+    merge.add_argument(
+        "--vocabulary",
+        type=int,
+        dest="vocabulary",
+        help="Number of different words, taken from a Zipf distribution",
+        default=50000
+    )
+    merge.add_argument(
+        "--block-format",
+        type=BlockFormat,
+        dest="block_format",
+        help="Format of the blocks, can be either 'text' or 'binary'",
+        default=BlockFormat.TEXT
+    )
+
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.benchmark == "posting-encoding":
+        posting_encoding_benchmark(args.search_index)
+    elif args.benchmark == "dynamic-pruning":
+        dynamic_pruning_benchmark(args.search_index, args.queries, args.n_results)
+    elif args.benchmark == "tokenizer":
+        tokenizer_benchmark(args.documents, args.limit, args.min_token_length, args.stop_words, args.language)
+    elif args.benchmark == "merge":
+        merge_benchmark(args.blocks, args.documents_per_block, args.tokens_per_document, args.vocabulary, args.block_format)
@@ -4,27 +4,75 @@
 
 
 import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Generator, List, Tuple
+from models.doc_mapping import DocMappingWriter
 from models.parser import Parser
-from models.ranker import RankerFactory,RankingMethod
+from models.ranker import Ranker, RankerFactory,RankingMethod
 from models.posting_list import PostingType
-from models.spimi import Spimi
+from models.spimi import BlockFormat, Spimi
 from models.tokenizer import Tokenizer
 from argparse import ArgumentParser
+from pathlib import Path
 import os
 
 current_time = time.time()
 BLOCK_DIR = 'cache/blocks'
 OUTPUT_INDEX = f'cache/index/{current_time}.index'
-DOC_MAPPING_FILE = f'cache/mappings/docs_mapping_{current_time}.map'
+DOC_MAPPING_FILE = f'cache/mappings/docs_mapping_{current_time}.bin'
 
 
-def index(stop_words,min_token_length,language,documents,posting_list_type,max_block_size,max_ram,ranking_method,schema,bm25_k,bm25_b):
-    ranker = None
-    if ranking_method != None:
-        ranker = RankerFactory(ranking_method)(posting_list_type, schema=schema, k=bm25_k, b=bm25_b)
+# state of each indexing worker process, created once by init_worker()
+worker_tokenizer: Tokenizer = None
+worker_indexer: Spimi = None
 
-    indexer = Spimi(ranker=ranker, max_ram_usage=max_ram, max_block_size=max_block_size,
-                auxiliary_dir=BLOCK_DIR, posting_type=posting_list_type)
+
+def create_ranker(ranking_method,posting_list_type,schema,bm25_k,bm25_b) -> Ranker:
+    if ranking_method == None:
+        return None
+    return RankerFactory(ranking_method)(posting_list_type, schema=schema, k=bm25_k, b=bm25_b)
+
+def init_worker(stop_words,min_token_length,language,posting_list_type,max_block_size,max_block_bytes,ranking_method,schema,bm25_k,bm25_b,block_format,stem_cache_size):
+    global worker_tokenizer, worker_indexer
+    worker_tokenizer = Tokenizer(min_token_length, stop_words, language, stem_cache_size)
+    worker_indexer = Spimi(ranker=create_ranker(ranking_method,posting_list_type,schema,bm25_k,bm25_b), max_block_bytes=max_block_bytes,
+                max_block_size=max_block_size, auxiliary_dir=BLOCK_DIR, posting_type=posting_list_type, block_format=block_format)
+
+def index_chunk(chunk_id:int, first_doc_id:int, texts:List[str]) -> Tuple[List[Path], Dict[str, object], List[str]]:
+    """
+    Tokenizes and indexes a chunk of documents inside a worker process. The blocks are named after the chunk so the merge reads them in the same order as the serial indexing
+
+    :param chunk_id: position of the chunk in the documents file
+    :param first_doc_id: doc id of the first text of the chunk
+    :param texts: parsed texts of the chunk
+    :return: blocks written, the ranker state of the chunk documents and the term samples of its blocks
+    """
+    worker_indexer.block_prefix = f'{chunk_id}_'
+    for doc_id, text in enumerate(texts, start=first_doc_id):
+        worker_indexer.add_document(doc_id=doc_id, tokens=worker_tokenizer.tokenize(text))
+    worker_indexer.flush_block()
+    block_paths, worker_indexer.merge_levels = worker_indexer.merge_levels[0], [[]]
+    term_samples, worker_indexer.term_samples = worker_indexer.term_samples, []
+    return block_paths, worker_indexer.ranker.export_state(), term_samples
+
+def chunks(parser_generator:Generator[Tuple[str, str], None, None], chunk_size:int) -> Generator[List[Tuple[str, str]], None, None]:
+    chunk = []
+    for row in parser_generator:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def index(stop_words,min_token_length,language,documents,posting_list_type,max_block_size,max_block_bytes,ranking_method,schema,bm25_k,bm25_b,workers=1,chunk_size=10000,block_format=BlockFormat.TEXT,compress=False,skip_block_size=0,stem_cache_size=100000,merge_fan_in=64,merge_buffer_bytes=64*1024*1024,merge_processes=1,background_merge=False):
+    ranker = create_ranker(ranking_method,posting_list_type,schema,bm25_k,bm25_b)
+
+    indexer = Spimi(ranker=ranker, max_block_bytes=max_block_bytes, max_block_size=max_block_size,
+                auxiliary_dir=BLOCK_DIR, posting_type=posting_list_type, block_format=block_format, compress=compress, skip_block_size=skip_block_size,
+                merge_fan_in=merge_fan_in, merge_buffer_bytes=merge_buffer_bytes, merge_processes=merge_processes,
+                background_merge=background_merge)
     
     indexer.extend_metadata({
         'posting_class': posting_list_type.value,
@@ -34,10 +82,22 @@ def index(stop_words,min_token_length,language,documents,posting_list_type,max_b
         'doc_mapping': DOC_MAPPING_FILE
     })
 
-    tokenizer = Tokenizer(min_token_length, stop_words, language)
+    tokenizer = Tokenizer(min_token_length, stop_words, language, stem_cache_size)
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=init_worker,
+            initargs=(stop_words,min_token_length,language,posting_list_type,max_block_size,max_block_bytes,ranking_method,schema,bm25_k,bm25_b,block_format,stem_cache_size))
+
+    def collect(future:Future):
+        block_paths, state, term_samples = future.result()
+        indexer.ranker.import_state(state)
+        indexer.term_samples.extend(term_samples)
+        # the blocks are added in the order of the chunks, the background merge can start with them
+        indexer.add_blocks(block_paths)
 
     counter:int = 0
-    with open(DOC_MAPPING_FILE, 'w', encoding='utf-8') as mapping_file:
+    with DocMappingWriter(DOC_MAPPING_FILE) as mapping_file:
 
         for document in documents:
             parser = Parser(document, 'review_id', ['review_headline', 'review_body'])
@@ -46,12 +106,28 @@ def index(stop_words,min_token_length,language,documents,posting_list_type,max_b
             print(f"Start {str(posting_list_type).lower().replace('postingtype.','')} indexing...")
             
             start = time.perf_counter()
-            for doc_id, parsed_text in parser_generator:
-                tokens = tokenizer.tokenize(parsed_text)
-                indexer.add_document(doc_id=counter, tokens=tokens)
-                mapping_file.write(f'{counter} {doc_id}\n')
-                counter += 1
-                
+            if executor == None:
+                for doc_id, parsed_text in parser_generator:
+                    tokens = tokenizer.tokenize(parsed_text)
+                    indexer.add_document(doc_id=counter, tokens=tokens)
+                    mapping_file.add(doc_id)
+                    counter += 1
+            else:
+                # the rows are parsed here, the gzip stream and the quoted fields that span lines can only be read in order,
+                # doc ids are given in reading order and the ranker states are collected in the same order
+                pending:deque = deque()
+                for chunk_id, chunk in enumerate(chunks(parser_generator, chunk_size)):
+                    for doc_id, _ in chunk:
+                        mapping_file.add(doc_id)
+                    pending.append(executor.submit(index_chunk, chunk_id, counter, [parsed_text for _, parsed_text in chunk]))
+                    counter += len(chunk)
+
+                    # limit the chunks waiting in memory
+                    if len(pending) >= 2*workers:
+                        collect(pending.popleft())
+                while len(pending) > 0:
+                    collect(pending.popleft())
+
             index = indexer.construct_index(OUTPUT_INDEX)
             end = time.perf_counter()
             print(
@@ -59,6 +135,12 @@ def index(stop_words,min_token_length,language,documents,posting_list_type,max_b
 
             indexer.clear_blocks()
 
+    if executor == None and tokenizer.stem_cache != None:
+        print(f"Stem cache: {tokenizer.stem_cache.stats()}")
+
+    if executor != None:
+        executor.shutdown()
+
     return index
 
 def parse_args():
@@ -110,11 +192,89 @@ def parse_args():
         required=False
     )
     arg_parser.add_argument(
-        "--max-ram",
-        dest="max_ram",
+        "--max-block-bytes",
+        dest="max_block_bytes",
+        type=int,
+        default=512 * 1024 * 1024,
+        help="Estimated memory in bytes of the terms and posting lists inside each temporary block, the block is written when it is reached",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--block-format",
+        dest="block_format",
+        type=BlockFormat,
+        default=BlockFormat.TEXT,
+        help="Format of the temporary blocks, can be either 'text' or 'binary' which is faster to write and merge",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--merge-fan-in",
+        dest="merge_fan_in",
+        type=int,
+        default=64,
+        help="Maximum number of temporary blocks merged at once, when there are more they are merged in several passes into runs written in the blocks directory (0 to merge all at once)",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--merge-buffer-bytes",
+        dest="merge_buffer_bytes",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="Memory in bytes of the read buffers of each merge, split between the blocks merged at once",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--merge-processes",
+        dest="merge_processes",
+        type=int,
+        default=1,
+        help="Number of processes of the final merge, the terms are split in ranges of about the same size and each process merges one of them",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--background-merge",
+        action="store_true",
+        dest="background_merge",
+        help="Merge every --merge-fan-in temporary blocks into a run in another process while the documents are still being indexed",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--compress",
+        action="store_true",
+        dest="compress",
+        help="Write the posting lists of the final index with gaps between doc ids and variable byte encoding",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--skip-block-size",
+        dest="skip_block_size",
+        type=int,
+        default=0,
+        help="Split the compressed posting lists in blocks of this number of documents with skip entries, so the searcher only decodes the blocks it needs (0 to disable)",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--stem-cache-size",
+        dest="stem_cache_size",
+        type=int,
+        default=100000,
+        help="Number of stems kept by the tokenizer, the least recently used are evicted first",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Number of processes that tokenize and index the documents parsed by the main process, the resulting index is the same for any number of workers",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
         type=int,
-        default=95,
-        help="Maximum amount of ram usage permited before writting temporary files",
+        default=10000,
+        help="Number of documents sent at once to each worker when using more than one worker",
         required=False
     )
     arg_parser.add_argument(
@@ -158,4 +318,4 @@ if __name__ == '__main__':
         os.makedirs(f"cache/{dir}", exist_ok=True)
 
     args = parse_args()
-    index(args.stop_words,args.min_token_length,args.language,args.documents,args.posting_list_type,args.max_block_size,args.max_ram,args.ranking_method,args.schema,args.bm25_k,args.bm25_b)
\ No newline at end of file
+    index(args.stop_words,args.min_token_length,args.language,args.documents,args.posting_list_type,args.max_block_size,args.max_block_bytes,args.ranking_method,args.schema,args.bm25_k,args.bm25_b,args.workers,args.chunk_size,args.block_format,args.compress,args.skip_block_size,args.stem_cache_size,args.merge_fan_in,args.merge_buffer_bytes,args.merge_processes,args.background_merge)
\ No newline at end of file
@@ -0,0 +1,84 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from array import array
+import mmap
+import struct
+from typing import Dict, Iterable
+import numpy as np
+
+
+class DocMapping:
+    """
+    Binary mapping of the internal doc ids to the real ones, the real doc ids are written one after the other in internal doc id order
+    and followed by the start of each one, so every doc id is found with a single array lookup in the memory mapped file
+    """
+    # magic, number of documents and position of the starts array
+    header_struct: struct.Struct = struct.Struct('<4sQQ')
+    magic: bytes = b'DMAP'
+
+    file_map: mmap.mmap
+    size: int
+    starts: np.ndarray
+
+    def __init__(self, file_name: str) -> None:
+        with open(file_name, 'rb') as file:
+            self.file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, starts_position = DocMapping.header_struct.unpack_from(self.file_map)
+        if magic != DocMapping.magic:
+            raise Exception(f'"{file_name}" is not a binary doc mapping')
+        self.starts = np.frombuffer(self.file_map, dtype='<u8', count=self.size + 1, offset=starts_position)
+
+    @staticmethod
+    def is_doc_mapping(file_name: str) -> bool:
+        with open(file_name, 'rb') as file:
+            return file.read(len(DocMapping.magic)) == DocMapping.magic
+
+    def __getitem__(self, doc_id: int) -> str:
+        if doc_id < 0 or doc_id >= self.size: raise KeyError(doc_id)
+        return self.file_map[int(self.starts[doc_id]):int(self.starts[doc_id+1])].decode('utf-8')
+
+    def fetch(self, doc_ids: Iterable[int]) -> Dict[int, str]:
+        return {doc_id: self[doc_id] for doc_id in doc_ids}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def close(self) -> None:
+        # the starts are read in place from the map, they are dropped before it is closed
+        self.starts = None
+        self.file_map.close()
+
+
+class DocMappingWriter:
+    """
+    Write a binary doc mapping while the documents are indexed, the real doc ids must be added in internal doc id order starting at 0
+    """
+    file: object
+    starts: array
+
+    def __init__(self, file_name: str) -> None:
+        self.file = open(file_name, 'wb')
+        self.file.write(DocMapping.header_struct.pack(DocMapping.magic, 0, 0))
+        self.starts = array('Q', [self.file.tell()])
+
+    def add(self, doc_id: str) -> None:
+        self.starts.append(self.starts[-1] + self.file.write(doc_id.encode('utf-8')))
+
+    def close(self) -> None:
+        # the starts go after the doc ids and the header is written again with their position
+        starts_position = self.file.tell()
+        # aligned to 8 bytes so the starts can be read in place
+        starts_position += self.file.write(bytes(-starts_position % 8))
+        self.file.write(np.asarray(self.starts, dtype='<u8').tobytes())
+        self.file.seek(0)
+        self.file.write(DocMapping.header_struct.pack(DocMapping.magic, len(self.starts) - 1, starts_position))
+        self.file.close()
+
+    def __enter__(self) -> DocMappingWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
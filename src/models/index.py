@@ -5,11 +5,18 @@
 
 import os
 from types import FunctionType
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
+from models.doc_mapping import DocMapping
 from models.posting_list import PostingList, PostingListFactory, PostingType
+from models.posting_list_cache import PostingListCache
+from models.query_cache import QueryCache
+from models.read_write_lock import ReadWriteLock
+from models.term_dictionary import TermDictionary
 from models.ranker import Ranker, RankerFactory, RankingMethod
 import json
 import io
+import mmap
+import pickle
 
 
 class InvertedIndex:
@@ -17,35 +24,141 @@ class InvertedIndex:
     file: str
     posting_list_class: PostingList
     delimiter: str = ' '
+    records_per_page: int = 1024
     metadata: Dict[str, object]
     index_start: int
     index_end: int
     tiny_dict: Dict[str, object]
-
-
-    def __init__(self, inverted_index: Dict[str, PostingList], posting_type: PostingType=None, output_path: str = None) -> None:
+    lexicon: Dict[str, Tuple[int, int, int]] or TermDictionary
+    index_reader: io.BufferedReader
+    use_mmap: bool
+    maps: Dict[str, mmap.mmap]
+    posting_list_cache: PostingListCache
+    query_cache: QueryCache
+    doc_mapping: DocMapping
+    # the searches read the index files while the reload replaces them
+    lock: ReadWriteLock
+    # version of the index files that are loaded
+    version: Tuple[Tuple[int, int, int]]
+
+
+    def __init__(self, inverted_index: Dict[str, PostingList], posting_type: PostingType=None, output_path: str = None, use_mmap: bool = False, cache_bytes: int = None, query_cache_size: int = 0, query_cache_ttl: float = None) -> None:
         self.inverted_index = inverted_index if inverted_index != None else dict()
+        # posting lists read from the index file, bounded by cache_bytes
+        self.posting_list_cache = PostingListCache(cache_bytes)
+        # results of the repeated searches, dropped when the index files change and the index is then loaded again, the dictionary is written last
+        self.query_cache = QueryCache(query_cache_size, query_cache_ttl, [output_path, f'{output_path}.dictionary'] if inverted_index == None else None, on_change=self.reload)
+        self.lock = ReadWriteLock()
+        self.version = self.query_cache.files_version
         self.file = output_path
+        self.lexicon = dict()
+        self.use_mmap = use_mmap
+        self.maps = dict()
+        self.doc_mapping = None
         if inverted_index == None and output_path != None:
+            if os.path.exists(f'{output_path}.dictionary'):
+                # lexicon and tiny representations of the terms, nothing is read until a term is searched
+                self.lexicon = TermDictionary(f'{output_path}.dictionary')
+                self.index_reader = open(output_path, 'rb')
+            elif os.path.exists(f'{output_path}.lexicon'):
+                # indexes written before the dictionary
+                self.load_lexicon(f'{output_path}.lexicon')
+                self.index_reader = open(output_path, 'rb')
             self.load_dictionary(output_path)
+            if os.path.exists(f'{output_path}.doclengths'):
+                # the binary files are found next to the index even when it was moved
+                self.metadata['doc_lengths'] = f'{output_path}.doclengths'
             self.posting_list_class = PostingListFactory(PostingType(self.metadata['posting_class']))
             ranker:Ranker = Ranker(posting_type)
             if 'ranker' in self.metadata:
                 ranker = RankerFactory(RankingMethod(self.metadata['ranker']))
-            self.load_tiny_dictionary(f'{output_path}.tiny', ranker)
+            if os.path.exists(self.metadata.get('doc_mapping', '')) and DocMapping.is_doc_mapping(self.metadata['doc_mapping']):
+                self.doc_mapping = DocMapping(self.metadata['doc_mapping'])
+            if self.use_mmap:
+                # map the files once so every query reads them from the shared page cache
+                self.map_file(output_path)
+                if os.path.exists(self.metadata.get('doc_mapping', '')) and self.doc_mapping == None:
+                    self.map_file(self.metadata['doc_mapping'])
+            if isinstance(self.lexicon, TermDictionary):
+                self.tiny_dict = self.lexicon.tiny_dictionary(ranker.load_tiny)
+            else:
+                self.load_tiny_dictionary(f'{output_path}.tiny', ranker)
         if posting_type != None: self.posting_list_class = PostingListFactory(posting_type)
 
+    def reload(self, version: Tuple[Tuple[int, int, int]] = None) -> None:
+        """
+        Load the index files again after they changed, the posting lists read from the old ones are dropped.
+        The new files are loaded while the searches go on, then they replace the old ones once the searches reading them finish, and the old files and maps are closed
+
+        :param version: version of the index files
+        :return: None
+        """
+        index = InvertedIndex(None, output_path=self.file, use_mmap=self.use_mmap)
+        names = ('inverted_index', 'lexicon', 'index_reader', 'maps', 'doc_mapping', 'metadata', 'index_start', 'index_end', 'tiny_dict', 'posting_list_class')
+        with self.lock.write():
+            old = [getattr(self, name, None) for name in names]
+            for name in names:
+                if hasattr(index, name): setattr(self, name, getattr(index, name))
+            self.version = version
+            self.posting_list_cache.clear()
+
+        _, lexicon, index_reader, maps, doc_mapping, *_ = old
+        if isinstance(lexicon, TermDictionary): lexicon.close()
+        if index_reader != None: index_reader.close()
+        for file_map in maps.values(): file_map.close()
+        if doc_mapping != None: doc_mapping.close()
+
+    def map_file(self, file_name:str) -> mmap.mmap:
+        """
+        Memory map a file for reading, the map is kept until the index is deleted
+
+        :param file_name: file to map
+        :return: the read only memory map
+        """
+        with open(file_name, "rb") as file:
+            self.maps[file_name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.maps[file_name]
     
     def load_tiny_dictionary(self, file_name:str, ranker:Ranker):
         self.tiny_dict = dict()
+        if self.use_mmap:
+            tiny_map = self.map_file(file_name)
+            for line in iter(tiny_map.readline, b''):
+                term, obj = tuple(line.decode('utf-8', errors='ignore').split(' ', maxsplit=1))
+                self.tiny_dict[term] = ranker.load_tiny(obj)
+            return
+
         with open(file_name, "r", encoding='utf-8', errors='ignore') as file:
             for line in file:
                 term, obj = tuple(line.split(' ', maxsplit=1))
                 self.tiny_dict[term] = ranker.load_tiny(obj)
 
+    def load_lexicon(self, file_name:str):
+        """
+        Load the lexicon written when merging the blocks, it has the offset and length of each posting list inside the index file and the document frequency of the term
+
+        :param file_name: lexicon file
+        :return: None
+        """
+        with open(file_name, "r", encoding='utf-8', errors='ignore') as file:
+            for line in file:
+                term, offset, length, document_frequency = line.split(' ')
+                self.lexicon[term] = (int(offset), int(length), int(document_frequency))
+
     def load_dictionary(self, file_name:str):
         self.metadata = dict()
 
+        # the terms are already in the lexicon, only the metadata needs to be read
+        if len(self.lexicon) > 0:
+            with open(file_name, "rb") as file:
+                self.metadata = json.loads(file.readline())
+                self.index_start = file.tell()
+                offset, length, _ = self.lexicon.last() if isinstance(self.lexicon, TermDictionary) else max(self.lexicon.values())
+                self.index_end = offset + length + 1
+                file.seek(self.index_end)
+                self.metadata.update(json.loads(file.readline()))
+            return
+
         with open(file_name, "r", encoding='utf-8', errors='ignore') as file:
             num_lines = 0
             for line in file:
@@ -81,16 +194,98 @@ class InvertedIndex:
         if ranker == None:
             ranker = Ranker(self.posting_list_class().posting_type)
         ranker.load_metadata(self.metadata)
-        term_to_posting_lists = self.light_search(terms, ranker.load_posting_list)
-        results = ranker.order(terms, term_to_posting_lists)
+        key = self.query_key(terms, n, ranker)
+        # the index can be reloaded when the cache checks its files, so it is read only after
+        results = self.query_cache.get(key)
+        if results == None:
+            with self.lock.read():
+                version = self.version
+                ranker.load_metadata(self.metadata)
+                results = self.rank(terms, n, ranker)
+            # dropped by the cache when the index was reloaded meanwhile
+            self.query_cache.put(key, results, version)
 
-        if len(results) > n: results = results[:n]
-        
         if not show_score:
             results = [tpl[0] for tpl in results]
         return results
 
+    @staticmethod
+    def query_key(terms: List[str], n:int, ranker:Ranker) -> Tuple[object]:
+        """
+        Key of the results of a query in the query cache
+
+        :param terms: tokens of the query
+        :param n: number of results
+        :param ranker: ranker with its metadata loaded
+        :return: the tokens, n and the parameters of the ranker
+        """
+        return (tuple(str(term) for term in terms), n, ranker.cache_key())
+
+    def search_batch(self, queries: List[List[str]], n:int, ranker:Ranker, show_score:bool=False) -> List[List[int]] or List[List[Tuple[int, float]]]:
+        """
+        Search many queries at once, the posting list of each term is read once for all of them and the terms are read in sorted order, which is the order of the index file
+
+        :param queries: tokens of each query
+        :param n: number of results of each query
+        :param ranker: ranker of the index
+        :param show_score: return the score with each doc id
+        :return: results of each query in the order of the queries
+        """
+        if ranker == None:
+            ranker = Ranker(self.posting_list_class().posting_type)
+        ranker.load_metadata(self.metadata)
+        keys = [self.query_key(terms, n, ranker) for terms in queries]
+        results = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, query_results in enumerate(results) if query_results == None]
+
+        terms = sorted(set(term for i in missing for term in keys[i][0]))
+        with self.lock.read():
+            version = self.version
+            ranker.load_metadata(self.metadata)
+            term_to_posting_lists = self.light_search(terms, self.posting_list_loader(ranker))
+            for i in missing:
+                query_posting_lists = { term: term_to_posting_lists[term] for term in dict.fromkeys(keys[i][0]) }
+                results[i] = self.order(queries[i], query_posting_lists, n, ranker)
+        for i in missing:
+            self.query_cache.put(keys[i], results[i], version)
+
+        if not show_score:
+            results = [[tpl[0] for tpl in query_results] for query_results in results]
+        return results
+
+    def posting_list_loader(self, ranker:Ranker) -> FunctionType:
+        if self.skip_blocks:
+            return ranker.load_posting_list_skip_bytes
+        return ranker.load_posting_list_bytes if self.compressed else ranker.load_posting_list
+
+    def rank(self, terms: List[str], n:int, ranker:Ranker) -> List[Tuple[int, float]]:
+        term_to_posting_lists = self.light_search(terms, self.posting_list_loader(ranker))
+        return self.order(terms, term_to_posting_lists, n, ranker)
+
+    def order(self, terms: List[str], term_to_posting_lists: Dict[str, PostingList], n:int, ranker:Ranker) -> List[Tuple[int, float]]:
+        if self.skip_blocks and not ranker.skips_blocks(term_to_posting_lists, n):
+            # the rankers that do not use the skip entries get the whole posting lists
+            term_to_posting_lists = { term: posting_list.decode() if posting_list != None else None for term, posting_list in term_to_posting_lists.items() }
+        results = ranker.order(terms, term_to_posting_lists, n)
+        # the skip posting lists keep the blocks decoded while ranking
+        if self.skip_blocks: self.posting_list_cache.refresh(term_to_posting_lists.keys())
+        return results
+
+    def fetch_doc_ids(self, doc_ids: List[int]) -> Dict[int, str]:
+        """
+        Real doc ids of the given internal doc ids, read from the binary doc mapping by position or searched in the text one
+
+        :param doc_ids: internal doc ids
+        :return: dictionary with the internal doc id as key and the real one as value
+        """
+        with self.lock.read():
+            if self.doc_mapping != None:
+                return self.doc_mapping.fetch(doc_ids)
+            return self.fetch_terms(doc_ids, self.metadata['doc_mapping'])
+
     def fetch_terms(self, terms: List[object], file_name:str, start:int=0, end:int=None) -> Dict[object, str]:
+        if file_name in self.maps:
+            return self.fetch_mapped_terms(terms, self.maps[file_name], start, end)
 
         matches:Dict[str, str] = dict()
 
@@ -130,54 +325,115 @@ class InvertedIndex:
                     matches[term] = line_posting_list.replace('\n', '')
         return matches
 
-    def light_search(self, terms: List[str], load_posting_list_func:FunctionType) -> Dict[str, PostingList]:
-        # deepcopy
-        terms = [str(term) for term in terms]
+    def fetch_mapped_terms(self, terms: List[object], file_map: mmap.mmap, start:int=0, end:int=None) -> Dict[object, str]:
+        """
+        Binary search of the lines of a memory mapped file sorted by their first word, like fetch_terms() but without seeking and reading the file
+
+        :param terms: terms to search, the words of the lines are converted to the type of each term before comparing
+        :param file_map: memory map of the file
+        :param start: byte in which the sorted lines start
+        :param end: byte in which the sorted lines end
+        :return: dictionary with the term as key and the rest of its line as value
+        """
+        if end == None: end = len(file_map)
 
-        matches = {term:None for term in terms}
+        matches:Dict[object, str] = dict()
         for term in terms:
-            if term in self.inverted_index:
-                posting_list:PostingList = self.inverted_index.get(term)
-                # add posting list that is already found in memory
-                if posting_list != None:
-                    matches[term] = posting_list
-                    terms.remove(term)
+            term_type = type(term)
+            low, high = start, end
+            while low < high:
+                middle = (low + high) // 2
+                line_start = max(start, file_map.rfind(b'\n', start, middle) + 1)
+                line_end = file_map.find(b'\n', middle, end)
+                if line_end == -1: line_end = end
+
+                line_term, _, line_rest = file_map[line_start:line_end].decode('utf-8', errors='ignore').partition(self.delimiter)
+                line_term = term_type(line_term)
+                if term == line_term:
+                    matches[term] = line_rest
+                    break
+                if term < line_term:
+                    high = line_start
+                else:
+                    low = line_end + 1
+        return matches
+
+    @property
+    def compressed(self) -> bool:
+        return self.metadata.get('posting_encoding') == 'vbyte'
+
+    @property
+    def skip_blocks(self) -> bool:
+        return self.metadata.get('skip_block_size', 0) > 0
+
+    def fetch_posting_lists(self, terms: List[str]) -> Dict[str, str] or Dict[str, bytes]:
+        """
+        Read the posting lists of the given terms with a single read for each, using the offsets in the lexicon
+
+        :param terms: terms that exist in the lexicon
+        :return: dictionary with the term as key and the posting list line as value, or its bytes when the index is compressed
+        """
+        matches:Dict[str, str] = dict()
+        index_map = self.maps.get(self.file)
+        for term in terms:
+            offset, length, _ = self.lexicon[term]
+            if index_map != None:
+                data = index_map[offset:offset + length] if self.compressed else memoryview(index_map)[offset:offset + length]
             else:
-                # this term does not appear in the dictionary
-                terms.remove(term)
+                data = os.pread(self.index_reader.fileno(), length, offset)
+            matches[term] = data if self.compressed else str(data, 'utf-8', errors='ignore')
+        return matches
+
+    def light_search(self, terms: List[str], load_posting_list_func:FunctionType) -> Dict[str, PostingList]:
+        matches:Dict[str, PostingList] = dict()
+        missing_terms:List[str] = []
+        for term in dict.fromkeys(str(term) for term in terms):
+            posting_list:PostingList = self.inverted_index.get(term)
+            # posting lists that are not in memory but appear in the dictionary
+            if posting_list == None and (term in self.inverted_index or term in self.lexicon):
+                posting_list = self.posting_list_cache.get(term)
+                if posting_list == None: missing_terms.append(term)
+            matches[term] = posting_list
 
         # early return if there is no more terms to search
-        if len(terms) == 0: return matches
+        if len(missing_terms) == 0: return matches
 
-        # fetch the terms that are in the index file but not in memory and store them
-        fetched_terms = self.fetch_terms(terms, self.file, self.index_start, self.index_end)
+        # fetch the terms that are in the index file but not in memory and cache them
+        if len(self.lexicon) > 0:
+            fetched_terms = self.fetch_posting_lists(missing_terms)
+        else:
+            fetched_terms = self.fetch_terms(missing_terms, self.file, self.index_start, self.index_end)
         for term, line in fetched_terms.items():
             posting_list = load_posting_list_func(line)
+            posting_list.tiny = self.tiny_dict.get(term, None)
             matches[term] = posting_list
-            self.inverted_index[term] = posting_list
-            self.inverted_index[term].tiny = self.tiny_dict.get(term, None)
+            self.posting_list_cache.put(term, posting_list)
         return matches
 
     def clear(self):
         self.inverted_index.clear()
+        self.posting_list_cache.clear()
 
-    def add_tokens(self, tokens: List[str], doc_id: int) -> None:
+    def add_tokens(self, tokens: List[str], doc_id: int) -> List[str]:
         """
         Adds the document id and position to the Postings list of the respective token
 
         :param token: token to be added
         :param doc_id: document id
         :param position: position of the token in the respective document id
-        :return: None
+        :return: terms that were not in the index yet
         """
+        new_terms = []
         for position, token in enumerate(tokens):
             posting_list:PostingList = self.inverted_index.get(token)
 
             if posting_list == None:
                 posting_list = self.posting_list_class()
                 self.inverted_index[token] = posting_list
+                new_terms.append(token)
 
             posting_list.add(doc_id, position)
+        return new_terms
 
     def sorted_terms(self):
         """
@@ -192,15 +448,97 @@ class InvertedIndex:
             output_file.write(f'{json.dumps(data)}\n')
 
     def save(self, output_file: str, ranker:Ranker) -> None:
-        with open(output_file, 'w') as file:
-            for term in self.sorted_terms():
-                line = f'{ term }{ self.delimiter }{ ranker.document_repr(self.inverted_index[term]) }\n'
-                file.write(line)
-    
+        self.write_lines(output_file, ((term, self.inverted_index[term]) for term in self.sorted_terms()), ranker)
+
+    def save_bytes(self, output_file: str, ranker:Ranker) -> None:
+        """
+        Write the index as consecutive pages of binary records, each page is a pickled list of terms and the plain data of their posting lists.
+        Pickle decodes whole pages without running python code for each posting, unlike the text lines
+
+        :param output_file: file to write the index
+        :param ranker: ranker used to get the data of the posting lists
+        :return: None
+        """
+        self.write_pages(output_file, ((term, self.inverted_index[term]) for term in self.sorted_terms()), ranker)
+
+    def write_lines(self, output_file: str, term_posting_lists: Iterable[Tuple[str, PostingList]], ranker:Ranker, buffer_size: int = -1) -> None:
+        """
+        Write terms and their posting lists as text lines, the format of save()
+
+        :param output_file: file to write
+        :param term_posting_lists: terms and their posting lists, sorted by term
+        :param ranker: ranker used to get the representation of the posting lists
+        :param buffer_size: size of the write buffer, the default one when -1
+        :return: None
+        """
+        self.write_line_records(output_file, ((term, ranker.document_repr(posting_list)) for term, posting_list in term_posting_lists), buffer_size)
+
+    def write_pages(self, output_file: str, term_posting_lists: Iterable[Tuple[str, PostingList]], ranker:Ranker, buffer_size: int = -1) -> None:
+        """
+        Write terms and their posting lists as pages of binary records, the format of save_bytes()
+
+        :param output_file: file to write
+        :param term_posting_lists: terms and their posting lists, sorted by term
+        :param ranker: ranker used to get the data of the posting lists
+        :param buffer_size: size of the write buffer, the default one when -1
+        :return: None
+        """
+        self.write_page_records(output_file, ((term, ranker.document_block(posting_list)) for term, posting_list in term_posting_lists), buffer_size)
+
+    def write_line_records(self, output_file: str, records: Iterable[Tuple[str, str]], buffer_size: int = -1) -> None:
+        """
+        Write terms and the text representation of their posting lists as lines
+
+        :param output_file: file to write
+        :param records: terms and their posting lists already represented, sorted by term
+        :param buffer_size: size of the write buffer, the default one when -1
+        :return: None
+        """
+        delimiter = self.delimiter
+        with open(output_file, 'w', buffering=buffer_size) as file:
+            for term, posting_list_repr in records:
+                file.write(f'{ term }{ delimiter }{ posting_list_repr }\n')
+
+    def write_page_records(self, output_file: str, records: Iterable[Tuple[str, object]], buffer_size: int = -1) -> None:
+        """
+        Write terms and the data of their posting lists as pickled pages
+
+        :param output_file: file to write
+        :param records: terms and the data of their posting lists, sorted by term
+        :param buffer_size: size of the write buffer, the default one when -1
+        :return: None
+        """
+        with open(output_file, 'wb', buffering=buffer_size) as file:
+            page = []
+            for record in records:
+                page.append(record)
+                if len(page) == self.records_per_page:
+                    pickle.dump(page, file, protocol=pickle.HIGHEST_PROTOCOL)
+                    page = []
+            if len(page) > 0:
+                pickle.dump(page, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def read_page(file: io.BufferedReader) -> List[Tuple[str, object]]:
+        """
+        Read the next page of binary records written by save_bytes()
+
+        :param file: binary file already opened
+        :return: list of tuples with the term and the data of its posting list, empty when the file has ended
+        """
+        try:
+            return pickle.load(file)
+        except EOFError:
+            return []
+
     def load(self, line: str, ranker:Ranker) -> Tuple[str, PostingList]:
         term, posting_list_str = tuple(line.split(self.delimiter, 1))
         return term, ranker.load_posting_list(posting_list_str)
 
+    def load_record(self, record: Tuple[str, object], ranker:Ranker) -> Tuple[str, PostingList]:
+        term, posting_list_data = record
+        return term, ranker.load_posting_list_block(posting_list_data)
+
     def __repr__(self):
         repr = ''
         for term, posting_list in self.inverted_index.items():
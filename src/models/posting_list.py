@@ -3,7 +3,9 @@
 # Vasco Sousa  - 93049
 
 from __future__ import annotations
-from typing import List
+from array import array
+import sys
+from typing import Iterable, List, Tuple
 from enum import Enum
 
 class PostingType(Enum):
@@ -13,6 +15,13 @@ class PostingType(Enum):
 
 class PostingList:
     posting_type: PostingType
+    # document ids in increasing order, the other data of each posting list is kept in arrays parallel to this one
+    doc_ids: array
+    # bytes lower than 128 end a variable byte number
+    high_bytes: bytes = bytes(range(128))
+    # memory taken by each document added and by each of its positions, used to estimate the size of a block
+    document_nbytes: int = 4
+    position_nbytes: int = 0
 
     def __init__(self, posting_type:PostingType)->None:
         self.posting_type = posting_type
@@ -20,9 +29,19 @@ class PostingList:
     def add(self, doc_id:int, position:int)->None:
         pass
 
-    def get_documents(self)->List[int]:
+    def get_documents(self)->array:
+        return self.doc_ids
+
+    def get_frequencies(self)->array:
         pass
 
+    def __len__(self)->int:
+        return len(self.doc_ids)
+
+    def nbytes(self)->int:
+        # the object and all of its arrays, including the ones added by the rankers
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sum(sys.getsizeof(value) for value in vars(self).values() if isinstance(value, array))
+
     @staticmethod
     def load(line:str)->PostingList:
         pass
@@ -31,6 +50,64 @@ class PostingList:
     def merge(posting_lists:List[PostingList])->PostingList:
         pass
 
+    def slice(self, start:int, end:int)->PostingList:
+        pass
+
+    def to_block(self)->object:
+        pass
+
+    @staticmethod
+    def from_block(data:object)->PostingList:
+        pass
+
+    def to_gaps(self, previous_doc_id:int=0)->List[int]:
+        pass
+
+    @staticmethod
+    def from_gaps(numbers:List[int], start:int=0, previous_doc_id:int=0)->Tuple[PostingList, int]:
+        pass
+
+    @staticmethod
+    def encode_vbyte(numbers:Iterable[int])->bytes:
+        """
+        Variable byte encoding of non negative numbers, 7 bits per byte starting by the lowest ones, the highest bit is set while the number continues
+
+        :param numbers: numbers to encode
+        :return: encoded bytes
+        """
+        data = bytearray()
+        for number in numbers:
+            while number >= 128:
+                data.append((number & 127) | 128)
+                number >>= 7
+            data.append(number)
+        return bytes(data)
+
+    @staticmethod
+    def decode_vbyte(data:bytes)->List[int]:
+        """
+        Decode the numbers written by encode_vbyte()
+
+        :param data: encoded bytes
+        :return: list of the decoded numbers
+        """
+        # every number fits in one byte
+        if len(data.translate(None, PostingList.high_bytes)) == 0:
+            return list(data)
+
+        numbers = []
+        number = 0
+        shift = 0
+        for byte in data:
+            if byte & 128:
+                number |= (byte & 127) << shift
+                shift += 7
+            else:
+                numbers.append(number | (byte << shift))
+                number = 0
+                shift = 0
+        return numbers
+
 from models.posting_lists.boolean_posting_list import BooleanPostingList
 from models.posting_lists.frequency_posting_list import FrequencyPostingList
 from models.posting_lists.positional_posting_list import PositionalPostingList
@@ -0,0 +1,102 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from collections import OrderedDict
+import sys
+import threading
+from typing import Dict, Iterable
+from models.posting_list import PostingList
+
+
+class PostingListCache:
+    """
+    Posting lists kept in memory by the searcher, the least recently used ones are evicted when all of them take more bytes than the memory budget
+    """
+    max_bytes: int
+    size: int
+    # posting list and its size in bytes, from the least to the most recently used
+    entries: OrderedDict
+    hits: int
+    misses: int
+    evictions: int
+    # the searches of the server share the cache
+    lock: threading.Lock
+
+    def __init__(self, max_bytes: int = None) -> None:
+        """
+        :param max_bytes: memory budget in bytes, without limit when None
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def posting_list_bytes(term: str, posting_list: PostingList) -> int:
+        return sys.getsizeof(term) + posting_list.nbytes()
+
+    def get(self, term: str) -> PostingList:
+        with self.lock:
+            entry = self.entries.get(term)
+            if entry == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(term)
+            return entry[0]
+
+    def put(self, term: str, posting_list: PostingList) -> None:
+        with self.lock:
+            if term in self.entries:
+                self.size -= self.entries.pop(term)[1]
+            size = PostingListCache.posting_list_bytes(term, posting_list)
+            self.entries[term] = (posting_list, size)
+            self.size += size
+            self.evict()
+
+    def refresh(self, terms: Iterable[str]) -> None:
+        """
+        Measure again the posting lists that grew since they were added, like the skip posting lists after decoding some blocks
+
+        :param terms: terms to measure
+        :return: None
+        """
+        with self.lock:
+            for term in terms:
+                entry = self.entries.get(term)
+                if entry == None: continue
+                size = PostingListCache.posting_list_bytes(term, entry[0])
+                self.size += size - entry[1]
+                self.entries[term] = (entry[0], size)
+            self.evict()
+
+    def evict(self) -> None:
+        if self.max_bytes == None: return
+        while self.size > self.max_bytes and len(self.entries) > 0:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
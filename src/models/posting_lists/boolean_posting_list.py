@@ -3,37 +3,65 @@
 # Vasco Sousa  - 93049
 
 from __future__ import annotations
-from typing import List, Set
+from array import array
+from itertools import accumulate
+from typing import List, Tuple
 from models.posting_list import PostingList, PostingType
 
 
 class BooleanPostingList(PostingList):
-    posting_list: Set[int]
+    doc_ids: array
 
     def __init__(self):
         super().__init__(PostingType.BOOLEAN)
-        self.posting_list = set()
+        self.doc_ids = array('I')
 
     def add(self, doc_id:int, position:int=None):
-        self.posting_list.add(doc_id)
-    
-    def get_documents(self) -> List[int]:
-        return list(self.posting_list)
+        # documents are added in increasing order, so a repeated document is always the last one
+        if len(self.doc_ids) == 0 or self.doc_ids[-1] != doc_id:
+            self.doc_ids.append(doc_id)
+
+    def get_frequencies(self) -> array:
+        return array('I', [1]) * len(self.doc_ids)
 
     @staticmethod
     def load(line:str) -> BooleanPostingList:
         new_posting_list = BooleanPostingList()
-        for doc_id in line.split(' '):
-            new_posting_list.posting_list.add(doc_id)
+        new_posting_list.doc_ids = array('I', map(int, line.split(' ')))
         return new_posting_list
 
     @staticmethod
     def merge(posting_lists:List[BooleanPostingList]) -> BooleanPostingList:
-        new_posting_list:BooleanPostingList = max(posting_lists, key=lambda posting_list: len(posting_list.posting_list))
-        posting_lists.remove(new_posting_list)
-        for boolean_posting_list in posting_lists:
-            new_posting_list.posting_list.update(boolean_posting_list.posting_list)
+        # the posting lists come from consecutive blocks, whose documents do not overlap, so the arrays are just concatenated
+        new_posting_list:BooleanPostingList = posting_lists[0]
+        for posting_list in posting_lists[1:]:
+            new_posting_list.doc_ids.extend(posting_list.doc_ids)
+        return new_posting_list
+
+    def slice(self, start:int, end:int) -> BooleanPostingList:
+        new_posting_list = BooleanPostingList()
+        new_posting_list.doc_ids = self.doc_ids[start:end]
         return new_posting_list
 
+    def to_block(self) -> object:
+        return self.doc_ids
+
+    @staticmethod
+    def from_block(data:object) -> BooleanPostingList:
+        new_posting_list = BooleanPostingList()
+        new_posting_list.doc_ids = data
+        return new_posting_list
+
+    def to_gaps(self, previous_doc_id:int=0) -> List[int]:
+        # number of documents followed by the gap to the previous document
+        return [len(self.doc_ids)] + [doc_id - previous_doc_id for previous_doc_id, doc_id in zip([previous_doc_id] + self.doc_ids[:-1].tolist(), self.doc_ids)]
+
+    @staticmethod
+    def from_gaps(numbers:List[int], start:int=0, previous_doc_id:int=0) -> Tuple[BooleanPostingList, int]:
+        new_posting_list = BooleanPostingList()
+        end = start + 1 + numbers[start]
+        new_posting_list.doc_ids = array('I', accumulate(numbers[start+1:end], initial=previous_doc_id))[1:]
+        return new_posting_list, end
+
     def __repr__(self):
-        return ' '.join([str(posting) for posting in self.posting_list])
+        return ' '.join([str(doc_id) for doc_id in self.doc_ids])
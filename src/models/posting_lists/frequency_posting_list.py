@@ -3,50 +3,83 @@
 # Vasco Sousa  - 93049
 
 from __future__ import annotations
-from typing import Dict, List
+from array import array
+from itertools import accumulate
+from typing import List, Tuple
 from models.posting_list import PostingList, PostingType
 
 
 class FrequencyPostingList(PostingList):
-    posting_list: Dict[int, int]
+    doc_ids: array
+    frequencies: array
+    document_nbytes: int = 8
 
     def __init__(self):
         super().__init__(PostingType.FREQUENCY)
-        self.posting_list = dict()
+        self.doc_ids = array('I')
+        self.frequencies = array('I')
 
     def add(self, doc_id:int, position:int=None):
-        freq = self.posting_list.get(doc_id)
-        if freq == None: self.posting_list[doc_id] = 1
-        else: self.posting_list[doc_id] = freq + 1
-        
+        # documents are added in increasing order, so a repeated document is always the last one
+        if len(self.doc_ids) > 0 and self.doc_ids[-1] == doc_id:
+            self.frequencies[-1] += 1
+        else:
+            self.doc_ids.append(doc_id)
+            self.frequencies.append(1)
 
-    def get_documents(self) -> List[int]:
-        return list(self.posting_list.keys())
-        
+    def get_frequencies(self) -> array:
+        return self.frequencies
 
     @staticmethod
     def merge(posting_lists:List[FrequencyPostingList]) -> FrequencyPostingList:
-        new_posting_list:FrequencyPostingList = max(posting_lists, key=lambda posting_list: len(posting_list.posting_list))
-        posting_lists.remove(new_posting_list)
-        for posting_list in posting_lists:
-            for doc_id, freq in posting_list.posting_list.items():
-                new_freq = new_posting_list.posting_list.get(doc_id)
-                if new_freq == None:
-                    new_posting_list.posting_list[doc_id] = freq
-                else:
-                    new_posting_list.posting_list[doc_id] = freq + new_freq
+        # the posting lists come from consecutive blocks, whose documents do not overlap, so the arrays are just concatenated
+        new_posting_list:FrequencyPostingList = posting_lists[0]
+        for posting_list in posting_lists[1:]:
+            new_posting_list.doc_ids.extend(posting_list.doc_ids)
+            new_posting_list.frequencies.extend(posting_list.frequencies)
         return new_posting_list
 
+    def slice(self, start:int, end:int) -> FrequencyPostingList:
+        new_posting_list = FrequencyPostingList()
+        new_posting_list.doc_ids = self.doc_ids[start:end]
+        new_posting_list.frequencies = self.frequencies[start:end]
+        return new_posting_list
+
+    @staticmethod
+    def load(line:str) -> FrequencyPostingList:
+        new_posting_list = FrequencyPostingList()
+        numbers = array('I', map(int, line.replace(':', ' ').split(' ')))
+        new_posting_list.doc_ids = numbers[0::2]
+        new_posting_list.frequencies = numbers[1::2]
+        return new_posting_list
+
+    def to_block(self) -> object:
+        return (self.doc_ids, self.frequencies)
+
     @staticmethod
-    def load(line:str)->PostingList:
+    def from_block(data:object) -> FrequencyPostingList:
         new_posting_list = FrequencyPostingList()
-        for posting in line.split(' '):
-            docid_freq = posting.split(':')
-            new_posting_list.posting_list[docid_freq[0]] = docid_freq[1]
+        new_posting_list.doc_ids, new_posting_list.frequencies = data
         return new_posting_list
- 
+
+    def to_gaps(self, previous_doc_id:int=0) -> List[int]:
+        # number of documents followed by the gap to the previous document and the frequency of each document
+        numbers = [len(self.doc_ids)] * (1 + 2*len(self.doc_ids))
+        numbers[1::2] = [doc_id - previous_doc_id for previous_doc_id, doc_id in zip([previous_doc_id] + self.doc_ids[:-1].tolist(), self.doc_ids)]
+        numbers[2::2] = self.frequencies
+        return numbers
+
+    @staticmethod
+    def from_gaps(numbers:List[int], start:int=0, previous_doc_id:int=0) -> Tuple[FrequencyPostingList, int]:
+        new_posting_list = FrequencyPostingList()
+        n = numbers[start]
+        end = start + 1 + 2*n
+        new_posting_list.doc_ids = array('I', accumulate(numbers[start+1:end:2], initial=previous_doc_id))[1:]
+        new_posting_list.frequencies = array('I', numbers[start+2:end:2])
+        return new_posting_list, end
+
     def __repr__(self):
-        return ' '.join([f'{doc_id}:{freq}' for doc_id, freq in self.posting_list.items()])
-    
+        return ' '.join([f'{doc_id}:{freq}' for doc_id, freq in zip(self.doc_ids, self.frequencies)])
+
     def repr(self):
         return self.__repr__()
@@ -4,51 +4,123 @@
 
 
 from __future__ import annotations
-from typing import Dict, List
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import List, Tuple
 from models.posting_list import PostingList, PostingType
 
 
 class PositionalPostingList(PostingList):
 
-    posting_list: Dict[int, List[int]]
+    doc_ids: array
+    # index in positions of the first position of each document
+    offsets: array
+    # positions of every document, one after the other
+    positions: array
+    document_nbytes: int = 8
+    position_nbytes: int = 4
 
     def __init__(self):
         super().__init__(PostingType.POSITIONAL)
-        self.posting_list = dict()
+        self.doc_ids = array('I')
+        self.offsets = array('I')
+        self.positions = array('I')
 
     def add(self, doc_id:int, position:int):
-        saved_posting = self.posting_list.get(doc_id)
-        if saved_posting == None:
-            self.posting_list[doc_id] = [position]
-        else:
-            saved_posting.append(position)
+        # documents are added in increasing order, so a repeated document is always the last one
+        if len(self.doc_ids) == 0 or self.doc_ids[-1] != doc_id:
+            self.doc_ids.append(doc_id)
+            self.offsets.append(len(self.positions))
+        self.positions.append(position)
 
-    def get_documents(self) -> List[int]:
-        return list(self.posting_list.keys())
+    def get_frequencies(self) -> array:
+        ends = self.offsets[1:]
+        ends.append(len(self.positions))
+        return array('I', [end - offset for offset, end in zip(self.offsets, ends)])
+
+    def get_positions(self, doc_id:int) -> array:
+        """
+        Positions of a document, found by binary search over the document ids
+
+        :param doc_id: document id
+        :return: positions of the term in the document, empty if the document does not have the term
+        """
+        i = bisect_left(self.doc_ids, doc_id)
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return array('I')
+        end = self.offsets[i+1] if i+1 < len(self.offsets) else len(self.positions)
+        return self.positions[self.offsets[i]:end]
 
     @staticmethod
     def load(line:str) -> PositionalPostingList:
         new_posting_list = PositionalPostingList()
-        for posting_list_line in line.split(' '):
-            parts = posting_list_line.split(':')
-            doc_id = parts[0]
-            for positions in parts[1:]:
-                for position in positions.split(','):
-                    new_posting_list.add(doc_id, int(position))
+        for posting in line.split(' '):
+            doc_id, positions = posting.split(':')
+            new_posting_list.doc_ids.append(int(doc_id))
+            new_posting_list.offsets.append(len(new_posting_list.positions))
+            new_posting_list.positions.extend(map(int, positions.split(',')))
         return new_posting_list
 
     @staticmethod
     def merge(posting_lists:List[PositionalPostingList]) -> PositionalPostingList:
-        new_posting_list:PositionalPostingList = max(posting_lists, key=lambda posting_list: len(posting_list.posting_list))
-        posting_lists.remove(new_posting_list)
-        for posting_list in posting_lists:
-            for doc_id, positions in posting_list.posting_list.items():
-                for position in positions:
-                    new_posting_list.add(doc_id, position)
+        # the posting lists come from consecutive blocks, whose documents do not overlap, so the arrays are just concatenated
+        new_posting_list:PositionalPostingList = posting_lists[0]
+        for posting_list in posting_lists[1:]:
+            shift = len(new_posting_list.positions)
+            new_posting_list.doc_ids.extend(posting_list.doc_ids)
+            new_posting_list.offsets.extend(array('I', [offset + shift for offset in posting_list.offsets]))
+            new_posting_list.positions.extend(posting_list.positions)
+        return new_posting_list
+
+    def slice(self, start:int, end:int) -> PositionalPostingList:
+        new_posting_list = PositionalPostingList()
+        new_posting_list.doc_ids = self.doc_ids[start:end]
+        if len(new_posting_list.doc_ids) == 0: return new_posting_list
+        first_position = self.offsets[start]
+        end_position = self.offsets[end] if end < len(self.offsets) else len(self.positions)
+        new_posting_list.offsets = array('I', [offset - first_position for offset in self.offsets[start:end]])
+        new_posting_list.positions = self.positions[first_position:end_position]
+        return new_posting_list
+
+    def to_block(self) -> object:
+        return (self.doc_ids, self.offsets, self.positions)
+
+    @staticmethod
+    def from_block(data:object) -> PositionalPostingList:
+        new_posting_list = PositionalPostingList()
+        new_posting_list.doc_ids, new_posting_list.offsets, new_posting_list.positions = data
         return new_posting_list
 
+    def to_gaps(self, previous_doc_id:int=0) -> List[int]:
+        # number of documents followed by the gap to the previous document, the number of positions and the gaps between positions of each document
+        numbers = [len(self.doc_ids)]
+        for doc_id, offset, count in zip(self.doc_ids, self.offsets, self.get_frequencies()):
+            numbers.append(doc_id - previous_doc_id)
+            numbers.append(count)
+            previous_position = 0
+            for position in self.positions[offset:offset+count]:
+                numbers.append(position - previous_position)
+                previous_position = position
+            previous_doc_id = doc_id
+        return numbers
+
+    @staticmethod
+    def from_gaps(numbers:List[int], start:int=0, previous_doc_id:int=0) -> Tuple[PositionalPostingList, int]:
+        new_posting_list = PositionalPostingList()
+        i = start + 1
+        doc_id = previous_doc_id
+        for _ in range(numbers[start]):
+            doc_id += numbers[i]
+            count = numbers[i+1]
+            new_posting_list.doc_ids.append(doc_id)
+            new_posting_list.offsets.append(len(new_posting_list.positions))
+            new_posting_list.positions.extend(accumulate(numbers[i+2:i+2+count]))
+            i += 2 + count
+        return new_posting_list, i
+
     def __repr__(self):
-        return ' '.join([f"{str(doc_id)}:{','.join([str(position) for position in postings_list])}" for doc_id, postings_list in self.posting_list.items()])
+        return ' '.join([f"{doc_id}:{','.join([str(position) for position in self.positions[offset:offset+count]])}" for doc_id, offset, count in zip(self.doc_ids, self.offsets, self.get_frequencies())])
 
     def __str__(self):
-        return repr(self)
\ No newline at end of file
+        return repr(self)
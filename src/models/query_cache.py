@@ -0,0 +1,153 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from collections import OrderedDict
+import os
+import threading
+import time
+from types import FunctionType
+from typing import Dict, Hashable, List, Tuple
+
+
+class QueryCache:
+    """
+    Results of the last searches, the least recently used are evicted when there are more than max_entries and they expire after ttl seconds.
+    Every result is dropped when the index files change, which is checked at most once every check_interval seconds.
+    """
+    max_entries: int
+    ttl: float
+    files: List[str]
+    # inode, size and modification time of each file
+    files_version: Tuple[Tuple[int, int, int]]
+    check_interval: float
+    # time of the last check of the index files
+    checked_at: float
+    # called when the index files change, so the index loads them again
+    on_change: FunctionType
+    # time when the results were saved and the results, from the least to the most recently used
+    entries: OrderedDict
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+    # the searches of the server share the cache
+    lock: threading.Lock
+
+    def __init__(self, max_entries: int = 0, ttl: float = None, files: List[str] = None, check_interval: float = 1.0, on_change: FunctionType = None) -> None:
+        """
+        :param max_entries: number of results kept, 0 disables the cache
+        :param ttl: seconds the results are valid, forever when None
+        :param files: index files, the cache is cleared when they change
+        :param check_interval: seconds between the checks of the index files
+        :param on_change: function called with the new version of the index files when they change
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.files = files if files != None else []
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+        self.files_version = self.read_files_version()
+        self.checked_at = time.monotonic()
+
+    def read_files_version(self) -> Tuple[Tuple[int, int, int]]:
+        version = []
+        for file in self.files:
+            if not os.path.exists(file):
+                version.append(None)
+                continue
+            stat = os.stat(file)
+            version.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(version)
+
+    def check_files(self) -> None:
+        """
+        Drop every result when the index files changed and call on_change with their new version, without holding the lock so the searches can go on meanwhile
+
+        :return: None
+        """
+        with self.lock:
+            # a stat on every hit would cost more than the lookup, changes are seen after at most check_interval seconds
+            if len(self.files) == 0 or time.monotonic() - self.checked_at < self.check_interval: return
+            self.checked_at = time.monotonic()
+            files_version = self.read_files_version()
+            if files_version == self.files_version: return
+            if len(self.entries) > 0: self.invalidations += 1
+            self.entries.clear()
+            self.files_version = files_version
+        if self.on_change == None: return
+        try:
+            self.on_change(files_version)
+        except (OSError, ValueError, KeyError):
+            # the index is still being written, it is loaded on the next check
+            with self.lock:
+                if self.files_version == files_version: self.files_version = None
+
+    def get(self, key: Hashable) -> List[object]:
+        """
+        Results saved for the key, if they did not expire and the index files did not change since then.
+        The index files are checked even when the cache is disabled, so the index is still reloaded when it changes
+
+        :param key: tokens of the query, number of results and ranker parameters
+        :return: copy of the results or None
+        """
+        self.check_files()
+        with self.lock:
+            if self.max_entries <= 0: return None
+            entry = self.entries.get(key)
+            if entry != None and self.ttl != None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(entry[1])
+
+    def put(self, key: Hashable, results: List[object], files_version: Tuple[Tuple[int, int, int]] = None) -> None:
+        """
+        Save the results of a query
+
+        :param key: tokens of the query, number of results and ranker parameters
+        :param results: results of the query
+        :param files_version: version of the index files the results were ranked with, they are not saved when the files changed since then
+        :return: None
+        """
+        with self.lock:
+            if self.max_entries <= 0: return
+            if files_version != None and files_version != self.files_version: return
+            self.entries[key] = (time.monotonic(), list(results))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -5,8 +5,10 @@
 
 from __future__ import annotations
 from enum import Enum
+import heapq
 from typing import Dict, List, Tuple
-from models.posting_list import PostingList, PostingType
+from models.posting_list import PostingList, PostingListFactory, PostingType
+from models.skip_posting_list import SkipPostingList
 
 class RankingMethod(Enum):
     TF_IDF = 'TF_IDF'
@@ -17,9 +19,12 @@ class RankingMethod(Enum):
 
 class Ranker:
     allowed_posting_types: List[PostingType]
+    posting_class: PostingList.__class__
+    # memory added to a posting list by the ranker for each document, used to estimate the size of a block
+    document_nbytes: int = 0
 
     def __init__(self, posting_type: PostingType, *args, **kwargs):
-        pass
+        self.posting_class = PostingListFactory(posting_type)
 
     def load_metadata(self, metadata: Dict[str, object]):
         self.metadata = metadata
@@ -27,7 +32,11 @@ class Ranker:
     def metadata(self) -> Dict[str, object]:
         return dict()
 
-    def pos_processing(self) -> Dict[str, object]:
+    def cache_key(self) -> Tuple:
+        # the ranker and its parameters, the searches with the same key return the same results
+        return (self.__class__.__name__,) + tuple(sorted((name, value) for name, value in vars(self).items() if isinstance(value, (bool, int, float, str))))
+
+    def pos_processing(self, output_path: str = None) -> Dict[str, object]:
         return dict()
 
     def before_add_tokens(self, term_to_postinglist: Dict[str, PostingList], tokens: List[str], doc_id: int):
@@ -39,12 +48,48 @@ class Ranker:
     def document_repr(self, posting_list: PostingList):
         return str(posting_list)
     
+    def document_block(self, posting_list: PostingList) -> object:
+        return posting_list.to_block()
+
     def merge_calculations(self, posting_list: PostingList):
         pass
 
+    def merge_posting_lists(self, posting_list_class: PostingList.__class__, posting_lists: List[PostingList]) -> PostingList:
+        return posting_list_class.merge(posting_lists)
+
+    def export_state(self) -> Dict[str, object]:
+        return dict()
+
+    def import_state(self, state: Dict[str, object]):
+        pass
+
     def term_repr(self, posting_list: PostingList):
         return str(posting_list)
     
+    def term_bytes(self, posting_list: PostingList, previous_doc_id: int = 0) -> bytes:
+        return PostingList.encode_vbyte(posting_list.to_gaps(previous_doc_id))
+
+    def slice_posting_list(self, posting_list: PostingList, start: int, end: int) -> PostingList:
+        return posting_list.slice(start, end)
+
+    def block_max_scores(self, posting_list: PostingList, block_size: int) -> List[float]:
+        # rankers without scores upper bounds
+        return [0] * ((len(posting_list) + block_size - 1) // block_size)
+
+    def term_skip_bytes(self, posting_list: PostingList, block_size: int) -> bytes:
+        """
+        Posting list split in blocks of block_size documents, each one encoded like term_bytes(), behind the skip entries of the blocks
+
+        :param posting_list: whole posting list
+        :param block_size: number of documents of each block
+        :return: bytes of the posting list
+        """
+        blocks = [self.slice_posting_list(posting_list, start, start + block_size) for start in range(0, len(posting_list), block_size)]
+        last_doc_ids = [block.get_documents()[-1] for block in blocks]
+        # the first gap of each block is from the last doc id of the previous block, which is in the skip entries
+        encoded_blocks = [self.term_bytes(block, previous_doc_id) for block, previous_doc_id in zip(blocks, [0] + last_doc_ids)]
+        return SkipPostingList.encode(encoded_blocks, last_doc_ids, self.block_max_scores(posting_list, block_size))
+
     def tiny_repr(self, posting_list: PostingList):
         return None
     
@@ -55,14 +100,41 @@ class Ranker:
     def load_posting_list(self, posting_list_class: PostingList.__class__, line: str) -> PostingList:
         return posting_list_class.load(line)
 
-    def order(self, term_to_posting_list: Dict[str, PostingList]) -> List[Tuple[int, float]]:
+    def load_posting_list_block(self, data: object) -> PostingList:
+        return self.posting_class.from_block(data)
+
+    def load_posting_list_bytes(self, data: bytes, previous_doc_id: int = 0) -> PostingList:
+        posting_list, _ = self.posting_class.from_gaps(PostingList.decode_vbyte(data), previous_doc_id=previous_doc_id)
+        return posting_list
+
+    def load_posting_list_skip_bytes(self, data: bytes) -> SkipPostingList:
+        return SkipPostingList(data, self.load_posting_list_bytes, lambda blocks: self.merge_posting_lists(self.posting_class, blocks))
+
+    def skips_blocks(self, term_to_posting_list: Dict[str, SkipPostingList], n: int = None) -> bool:
+        # rankers that take the skip posting lists as they are in order(), the others get them decoded
+        return False
+
+    def order(self, query: List[str], term_to_posting_list: Dict[str, PostingList], n: int = None) -> List[Tuple[int, float]]:
         res = list()
         for _, posting_list in term_to_posting_list.items():
             if posting_list == None:
                 continue
             for doc_id in posting_list.get_documents():
                 res.append((doc_id, 0))
-        return res
+        return res[:n]
+
+    @staticmethod
+    def top_k(scores: Dict[int, float], n: int = None) -> List[Tuple[int, float]]:
+        """
+        Documents with the highest scores, with a bounded heap instead of sorting all the scores when only a few are needed
+
+        :param scores: score of each document
+        :param n: number of documents to return, all of them when None
+        :return: list of (doc id, score) in the same order as sorting all the scores by decreasing score
+        """
+        if n == None or n >= len(scores):
+            return sorted(scores.items(), key=lambda i: i[1], reverse=True)
+        return heapq.nlargest(n, scores.items(), key=lambda i: i[1])
 
 
 from models.rankers.bm25 import BM25_Ranker
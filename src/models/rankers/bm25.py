@@ -4,10 +4,17 @@
 
 
 from collections import defaultdict
-from typing import DefaultDict, Dict, List
+from typing import DefaultDict, Dict, List, Tuple
+import numpy as np
 from models.posting_list import PostingList, PostingListFactory, PostingType
 from models.ranker import Ranker
+from models.skip_posting_list import SkipPostingList
 import math
+import threading
+
+
+# scores of every document used by score_documents(), one array per thread that is allocated once and cleared after each query
+score_buffers = threading.local()
 
 
 
@@ -15,6 +22,13 @@ class BM25_Ranker(Ranker):
     k: float
     b: float
     documents_length: DefaultDict
+    # the normalized document lengths are saved as integers in thousandths, which keeps the 3 decimal places they are rounded to
+    doc_length_scale: int = 1000
+    # document length divided by the average length times doc_lengths_scale, indexed by doc id, read in place from the memory mapped file of the index
+    doc_lengths: np.ndarray = None
+    doc_lengths_scale: int
+    # top n queries skip the documents that can not reach the top with the MaxScore algorithm
+    dynamic_pruning: bool
     allowed_posting_types = [PostingType.FREQUENCY]
     posting_class: PostingList.__class__
 
@@ -23,38 +37,242 @@ class BM25_Ranker(Ranker):
         self.posting_class = PostingListFactory(posting_type)
         self.k = kwargs['k'] if 'k' in kwargs else None
         self.b = kwargs['b'] if 'b' in kwargs else None
+        self.dynamic_pruning = kwargs.get('dynamic_pruning', False)
     
     @staticmethod
     def load_tiny(line: str):
-        return float(line)
+        # idf and the score upper bound of the term, indexes written before the upper bounds only have the idf
+        return tuple(float(value) for value in line.split())
     
     def merge_calculations(self, posting_list: PostingList):
         posting_list.idf = self.calculate_idf(posting_list)
+        posting_list.max_score = self.calculate_max_score(posting_list)
+
+    def calculate_max_score(self, posting_list: PostingList) -> float:
+        """
+        Highest score the term gives to any of its documents, the upper bound used to skip documents in the top n queries
+
+        :param posting_list: whole posting list of the term, with its idf already calculated
+        :return: the score upper bound
+        """
+        if self.doc_lengths is None:
+            # the same normalized document lengths that are saved for the searcher, so the bound holds for the scores computed there
+            self.set_doc_lengths(self.doc_length_normalization())
+        docs, freqs = self.posting_arrays(posting_list)
+        return float(self.term_scores(posting_list.idf, docs, freqs).max())
+
+    def block_max_scores(self, posting_list: PostingList, block_size: int) -> List[float]:
+        docs, freqs = self.posting_arrays(posting_list)
+        return np.maximum.reduceat(self.term_scores(posting_list.idf, docs, freqs), np.arange(0, len(docs), block_size)).tolist()
+
+    @staticmethod
+    def posting_arrays(posting_list: PostingList) -> Tuple[np.ndarray, np.ndarray]:
+        # doc ids and frequencies of a posting list, the doc ids are not copied
+        return np.frombuffer(posting_list.get_documents(), dtype=np.uint32), np.frombuffer(posting_list.get_frequencies(), dtype=np.uint32)
+
+    def term_scores(self, idf: float, docs: np.ndarray, freqs: np.ndarray) -> np.ndarray:
+        """
+        BM25 score a term gives to each of the given documents
+
+        :param idf: idf of the term
+        :param docs: doc ids
+        :param freqs: frequency of the term in each document
+        :return: score of each document
+        """
+        tf = (freqs * (self.k + 1)) / (freqs + self.length_normalization(docs))
+        return idf * tf
+
+    def dl_div_avgdl(self, docs: np.ndarray) -> np.ndarray:
+        # the division gives the same floats as the lengths rounded to 3 decimal places
+        return self.doc_lengths[docs] / self.doc_lengths_scale
+
+    def length_normalization(self, docs: np.ndarray) -> np.ndarray:
+        """
+        k * (1 - b + b * dl/avgdl) of the given documents, the part of the denominator that does not depend on the term.
+        It is computed for the scored documents only, so only the pages of the document lengths file with them are read
+
+        :param docs: doc ids
+        :return: length normalization of each document
+        """
+        return self.k * (1 - self.b + self.b * self.dl_div_avgdl(docs))
+
+    def score_documents(self, query:List[str], term_to_posting_list: Dict[str, PostingList]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 score of every document with at least one query term, computed a whole posting list at a time.
+        The scores are added in an array with an entry per document of the collection, which is reused by the queries of the same thread
+        and only its matched entries are cleared, so a query costs the size of its posting lists and not the number of documents
+
+        :param query: query terms
+        :param term_to_posting_list: posting list of each query term
+        :return: ids of the matched documents in increasing order and their scores
+        """
+        scores = getattr(score_buffers, 'scores', None)
+        if scores is None or len(scores) != len(self.doc_lengths):
+            scores = score_buffers.scores = np.zeros(len(self.doc_lengths))
+
+        matched = []
+        try:
+            for term in dict.fromkeys(query):
+                posting_list = term_to_posting_list.get(term)
+                if posting_list != None:
+                    docs, freqs = self.posting_arrays(posting_list)
+
+                    idf = posting_list.tiny[0]
+                    scores[docs] += self.term_scores(idf, docs, freqs)
+                    matched.append(docs)
+
+            # the doc ids of a posting list are already sorted and unique
+            if len(matched) == 0:
+                docs = np.empty(0, dtype=np.intp)
+            elif len(matched) == 1:
+                docs = matched[0].astype(np.intp)
+            else:
+                docs = np.unique(np.concatenate(matched)).astype(np.intp, copy=False)
+            return docs, scores[docs]
+        finally:
+            for docs in matched:
+                scores[docs] = 0
+
+    @staticmethod
+    def top_k_arrays(docs: np.ndarray, scores: np.ndarray, n: int = None) -> List[Tuple[int, float]]:
+        """
+        Documents with the highest scores, only the ones scoring at least the n-th highest score are sorted.
+        The documents with the same score are ordered by doc id, while the rankers that sort a dictionary of scores keep them in the order
+        they were first matched (by the first query term that has them). This changes the order of the ties of the BM25 rankers from the
+        one they had before, but it does not depend on the order of the query terms and the MaxScore pruning returns exactly the same results
+
+        :param docs: doc ids in increasing order
+        :param scores: score of each document
+        :param n: number of documents to return, all of them when None
+        :return: list of (doc id, score) by decreasing score, documents with the same score ordered by doc id
+        """
+        if n != None and 0 < n < len(scores):
+            # every document tied with the n-th score is kept so the ties are broken like in a full sort
+            threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+            candidates = np.flatnonzero(scores >= threshold)
+            docs, scores = docs[candidates], scores[candidates]
+        ranking = np.argsort(-scores, kind='stable')[:n]
+        return list(zip(docs[ranking].tolist(), scores[ranking].tolist()))
+
+    def find_postings(self, posting_list: SkipPostingList, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Postings of some documents in a posting list, only the blocks where the documents would be are decoded
+
+        :param posting_list: posting list of a term
+        :param candidates: doc ids in increasing order
+        :return: which candidates have the term and the frequency of the term in each candidate
+        """
+        found = np.zeros(len(candidates), dtype=bool)
+        freqs = np.zeros(len(candidates), dtype=np.uint32)
+
+        blocks = [(0, len(candidates), posting_list.posting_list)]
+        if posting_list.posting_list == None:
+            # the candidates are sorted, so the ones inside the same block are next to each other
+            starts = np.searchsorted(posting_list.find_blocks(candidates), np.arange(len(posting_list) + 1))
+            touched = np.flatnonzero(np.diff(starts))
+            # decoding most blocks one by one is slower than decoding the whole posting list
+            if len(touched) * 2 > len(posting_list):
+                blocks = [(0, len(candidates), posting_list.decode())]
+            else:
+                blocks = [(starts[i], starts[i+1], posting_list.block(i)) for i in touched]
+
+        for start, end, block in blocks:
+            docs, block_freqs = self.posting_arrays(block)
+            block_candidates = candidates[start:end]
+            positions = np.minimum(np.searchsorted(docs, block_candidates), len(docs) - 1)
+            hits = docs[positions] == block_candidates
+            found[start:end] = hits
+            freqs[start:end][hits] = block_freqs[positions[hits]]
+        return found, freqs
+
+    def score_candidates(self, candidates: np.ndarray, posting_lists: List[SkipPostingList], idfs: List[float]) -> np.ndarray:
+        """
+        BM25 score of some documents, the postings of each document are found with the skip entries and binary search
+
+        :param candidates: doc ids in increasing order
+        :param posting_lists: posting list of each query term, in the query order
+        :param idfs: idf of each query term
+        :return: score of each candidate, the same as the one computed by score_documents()
+        """
+        scores = np.zeros(len(candidates))
+        for posting_list, idf in zip(posting_lists, idfs):
+            found, freqs = self.find_postings(posting_list, candidates)
+            scores[found] += self.term_scores(idf, candidates[found], freqs[found])
+        return scores
+
+    def max_score_order(self, query:List[str], term_to_posting_list: Dict[str, PostingList], n:int) -> List[Tuple[int, float]]:
+        """
+        Top n documents with the MaxScore dynamic pruning, the result is the same as the exhaustive order().
+        The terms are visited from the highest score upper bound to the lowest, the documents of a visited term are scored with every query term and the n-th best score so far is the threshold.
+        When the upper bounds of the terms not yet visited add up to less than the threshold, the documents that only have those terms can not reach the top n and their postings are not scored.
+        With skip posting lists, the blocks of a visited term whose highest score can not reach the threshold are not decoded, neither are the blocks of the other terms without candidates.
 
-    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList]) -> Dict[int, float]:
+        :param query: query terms
+        :param term_to_posting_list: posting list of each query term, decoded or skip posting lists
+        :param n: number of documents to return
+        :return: list of (doc id, score) by decreasing score
+        """
+        posting_lists = [term_to_posting_list[term] for term in dict.fromkeys(query) if term_to_posting_list.get(term) != None]
+        # decoded posting lists are seen as a single block with the upper bound of the term
+        terms = [posting_list if isinstance(posting_list, SkipPostingList) else SkipPostingList.from_posting_list(posting_list, posting_list.tiny[1]) for posting_list in posting_lists]
+        idfs = [posting_list.tiny[0] for posting_list in posting_lists]
+        max_scores = [posting_list.tiny[1] for posting_list in posting_lists]
+        visit_order = sorted(range(len(terms)), key=lambda i: max_scores[i], reverse=True)
 
-        tfs = dict()
-        for token in query:
-            tfs[token] = query.count(token)
+        # small margin for the rounding of the sums, a document tied with the threshold could still enter the top by doc id
+        margin = 1 + 1e-9
+        seen = np.empty(0, dtype=np.uint32)
+        candidates = np.empty(0, dtype=np.uint32)
+        scores = np.empty(0)
+        threshold = -math.inf
+        for visited, i in enumerate(visit_order, start=1):
+            term = terms[i]
+            not_visited = visit_order[visited:]
+            remaining_max_score = sum(max_scores[j] for j in not_visited)
 
-        scores: DefaultDict[int, float] = defaultdict(float)  # doc_id, score
+            blocks = np.flatnonzero((term.max_scores + remaining_max_score) * margin >= threshold)
+            if len(blocks) == len(term):
+                docs, freqs = self.posting_arrays(term.decode())
+            elif len(blocks) > 0:
+                block_arrays = [self.posting_arrays(term.block(block)) for block in blocks]
+                docs = np.concatenate([docs for docs, _ in block_arrays])
+                freqs = np.concatenate([freqs for _, freqs in block_arrays])
+            else:
+                docs, freqs = np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32)
 
-        dl_div_avgdl = self.metadata["doc_length_normalization"]
+            new = ~np.isin(docs, seen, assume_unique=True)
+            docs, freqs = docs[new], freqs[new]
+            seen = np.concatenate((seen, docs))
 
-        for term, tf in tfs.items():
-            posting_list = term_to_posting_list.get(term)
-            if posting_list != None:
-                docs: List[int] = posting_list.get_documents()
+            # the new documents are not in the terms already visited, their score is at most the one of this term plus the highest score of their blocks in the terms not visited yet
+            bounds = self.term_scores(idfs[i], docs, freqs)
+            for j in not_visited:
+                bounds += terms[j].block_max_scores(docs)
+            docs = docs[bounds * margin >= threshold]
 
-                for doc in docs:
-                    freq = posting_list.posting_list[doc]
-                    
-                    idf = posting_list.tiny
-                    tf = (freq * (self.k + 1)) / (freq + self.k * (1 - self.b + self.b * dl_div_avgdl[doc]))
-                    
-                    scores[doc] += idf * tf
+            candidates = np.concatenate((candidates, docs))
+            scores = np.concatenate((scores, self.score_candidates(docs, terms, idfs)))
+            if len(scores) >= n:
+                threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
 
-        return sorted(scores.items(), key=lambda i: i[1], reverse=True)
+            if remaining_max_score * margin < threshold: break
+
+        by_doc = np.argsort(candidates, kind='stable')
+        return BM25_Ranker.top_k_arrays(candidates[by_doc], scores[by_doc], n)
+
+    def can_prune(self, term_to_posting_list: Dict[str, PostingList]) -> bool:
+        # the upper bounds are only valid for the k and b of the index
+        if self.k != float(self.metadata['k']) or self.b != float(self.metadata['b']): return False
+        return all(len(posting_list.tiny) > 1 for posting_list in term_to_posting_list.values() if posting_list != None)
+
+    def skips_blocks(self, term_to_posting_list: Dict[str, PostingList], n: int = None) -> bool:
+        return self.dynamic_pruning and n != None and n > 0 and self.can_prune(term_to_posting_list)
+
+    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList], n:int=None) -> List[Tuple[int, float]]:
+        if self.skips_blocks(term_to_posting_list, n):
+            return self.max_score_order(query, term_to_posting_list, n)
+        docs, scores = self.score_documents(query, term_to_posting_list)
+        return BM25_Ranker.top_k_arrays(docs, scores, n)
 
     def document_repr(self, posting_list: PostingList):
         return str(posting_list)
@@ -63,7 +281,7 @@ class BM25_Ranker(Ranker):
         return f'{self.document_repr(posting_list)}'
 
     def tiny_repr(self, posting_list: PostingList):
-        return str(posting_list.idf)
+        return f'{posting_list.idf} {posting_list.max_score}'
 
     def metadata(self) -> Dict[str, object]:
         return {
@@ -73,11 +291,24 @@ class BM25_Ranker(Ranker):
             'b': self.b
         }
 
-    def pos_processing(self) -> Dict[str, object]:
+    def doc_length_normalization(self) -> np.ndarray:
+        """
+        Length of every document divided by the average length, rounded to 3 decimal places and kept in thousandths
+
+        :return: dense array indexed by doc id, the doc ids without a document have the average length
+        """
         avgdl = sum(self.documents_length.values()) / len(self.documents_length)
-        documents_length_normalized = { doc: round(doc_length/avgdl, 3) for doc, doc_length in self.documents_length.items() }
+        lengths = np.full(max(self.documents_length) + 1, self.doc_length_scale, dtype='<u4')
+        for doc, doc_length in self.documents_length.items():
+            lengths[doc] = round(round(doc_length/avgdl, 3) * self.doc_length_scale)
+        return lengths
+
+    def pos_processing(self, output_path: str = None) -> Dict[str, object]:
+        # the normalized lengths go to a binary file next to the index that the searcher memory maps
+        file_name = f'{output_path}.doclengths'
+        self.doc_length_normalization().tofile(file_name)
         return {
-            "doc_length_normalization": documents_length_normalized
+            "doc_lengths": file_name
         }
     
     def load_metadata(self, metadata: Dict[str, str]):
@@ -86,21 +317,42 @@ class BM25_Ranker(Ranker):
             raise Exception(f'Ranker "{ metadata["ranker"] }" not compatible')
         if self.k == None: self.k = float(metadata['k'])
         if self.b == None: self.b = float(metadata['b'])
+        if self.metadata is not metadata:
+            self.load_doc_length_normalization(metadata)
         self.metadata = metadata
 
+    def load_doc_length_normalization(self, metadata: Dict[str, object]):
+        if "doc_lengths" in metadata:
+            self.set_doc_lengths(np.memmap(metadata["doc_lengths"], dtype='<u4', mode='r'))
+            return
+        # indexes written before the binary file have a json object, its keys are always strings
+        doc_length_normalization = metadata["doc_length_normalization"]
+        doc_ids = np.fromiter(map(int, doc_length_normalization.keys()), dtype=np.int64, count=len(doc_length_normalization))
+        lengths = np.ones(doc_ids.max() + 1)
+        lengths[doc_ids] = np.fromiter(doc_length_normalization.values(), dtype=np.float64, count=len(doc_length_normalization))
+        self.set_doc_lengths(lengths, 1)
+
+    def set_doc_lengths(self, lengths: np.ndarray, scale: int = doc_length_scale):
+        # kept as they are, without a copy of the whole array
+        self.doc_lengths = lengths
+        self.doc_lengths_scale = scale
+
     def load_posting_list(self, line: str) -> PostingList:
 
-        posting_list = self.posting_class()
+        return self.posting_class.load(line)
 
-        for posting in line.split(' '):
-            doc_id, freq = tuple(posting.split(':'))
-            posting_list.posting_list[doc_id] = int(freq)
+    def export_state(self) -> Dict[str, object]:
+        # hand over the documents length gathered so far and start again, used to combine parallel indexers
+        state = { 'documents_length': self.documents_length }
+        self.documents_length = defaultdict(int)
+        return state
 
-        return posting_list
+    def import_state(self, state: Dict[str, object]):
+        self.documents_length.update(state['documents_length'])
 
     def after_add_tokens(self, term_to_postinglist: Dict[str, PostingList], tokens: List[str], doc_id: int):
         if doc_id not in self.documents_length:
             self.documents_length[doc_id] = len(tokens)
 
     def calculate_idf(self, posting_list: PostingList):
-        return round(math.log(len(self.documents_length)/len(posting_list.posting_list)), 3)
+        return round(math.log(len(self.documents_length)/len(posting_list)), 3)
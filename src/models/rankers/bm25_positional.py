@@ -3,11 +3,11 @@
 # Vasco Sousa  - 93049
 
 
-from collections import defaultdict
-from typing import DefaultDict, Dict, List
+from typing import DefaultDict, Dict, List, Tuple
 from models.posting_list import PostingList, PostingType
-from models.ranker import RankingMethod
+from models.ranker import Ranker, RankingMethod
 import math
+import numpy as np
 from models.rankers.bm25 import BM25_Ranker
 
 
@@ -18,6 +18,8 @@ class BM25_Positional_Ranker(BM25_Ranker):
     max_distance: int
     c: float
     documents_length: DefaultDict
+    min_dl_div_avgdl: float
+    max_dl_div_avgdl: float
     posting_class: PostingList.__class__
     allowed_posting_types = [PostingType.POSITIONAL]
     ranking_method: RankingMethod
@@ -57,8 +59,7 @@ class BM25_Positional_Ranker(BM25_Ranker):
             if posting_list == None:
                 term_to_positions[term] = []
             else:
-                positions = posting_list.posting_list.get(doc_id, [])
-                term_to_positions[term] = positions
+                term_to_positions[term] = posting_list.get_positions(doc_id)
 
         # calculate boost
         score = 0
@@ -70,26 +71,15 @@ class BM25_Positional_Ranker(BM25_Ranker):
                 score += self.compute_distance(i, term1_positions, j+i+1, term2_positions)
         return math.log10(score) if score > 0 else 0
     
-    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList]) -> Dict[int, float]:
-        tfs = dict()
-        for token in query:
-            tfs[token] = query.count(token)
+    def skips_blocks(self, term_to_posting_list: Dict[str, PostingList], n: int = None) -> bool:
+        # the positional boost has no upper bound, every document is scored
+        return False
 
-        scores: DefaultDict[int, float] = defaultdict(float)  # doc_id, score
-        dl_div_avgdl = self.metadata["doc_length_normalization"]
-        min_dl_div_avgdl = min(self.metadata["doc_length_normalization"].values())
-        max_dl_div_avgdl = max(self.metadata["doc_length_normalization"].values())
+    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList], n:int=None) -> List[Tuple[int, float]]:
 
         # calculate BM25 score
-        for term, tf in tfs.items():
-            posting_list = term_to_posting_list.get(term)
-            if posting_list != None:
-                docs: List[int] = posting_list.get_documents()
-                for doc in docs:
-                    freq = len(posting_list.posting_list[doc])
-                    idf = posting_list.tiny
-                    tf = (freq * (self.k + 1)) / (freq + self.k * (1 - self.b + self.b * dl_div_avgdl[doc]))
-                    scores[doc] += idf * tf
+        docs, bm25_scores = self.score_documents(query, term_to_posting_list)
+        scores: Dict[int, float] = dict(zip(docs.tolist(), bm25_scores.tolist()))  # doc_id, score
 
         # calculate positional boost
         for doc, bm25_score in scores.items():
@@ -97,10 +87,11 @@ class BM25_Positional_Ranker(BM25_Ranker):
 
             if boost_score > 0:
                 # normalize scores
-                doc_length_normalization = math.log2((dl_div_avgdl[doc]-min_dl_div_avgdl)/(max_dl_div_avgdl-min_dl_div_avgdl)+1)
+                min_dl_div_avgdl, max_dl_div_avgdl = self.dl_div_avgdl_range()
+                doc_length_normalization = math.log2((float(self.dl_div_avgdl(doc))-min_dl_div_avgdl)/(max_dl_div_avgdl-min_dl_div_avgdl)+1)
                 scores[doc] = bm25_score + (self.boost_weight) * boost_score / doc_length_normalization
 
-        return sorted(scores.items(), key=lambda i: i[1], reverse=True)
+        return Ranker.top_k(scores, n)
 
     def document_repr(self, posting_list: PostingList):
         return str(posting_list)
@@ -113,27 +104,30 @@ class BM25_Positional_Ranker(BM25_Ranker):
             'b': self.b
         }
     
-    def pos_processing(self) -> Dict[str, object]:
-        avgdl = sum(self.documents_length.values()) / len(self.documents_length)
-        documents_length_normalized = { doc: round(doc_length/avgdl, 3) for doc, doc_length in self.documents_length.items() }
-        return {
-            "doc_length_normalization": documents_length_normalized
-        }
-    
     def load_metadata(self, metadata: Dict[str, str]):
         # check if is the same ranker, posting list, etc
         if metadata['ranker'] != str(self.ranking_method).split('.')[1]:
             raise Exception(f'Ranker "{ metadata["ranker"] }" not compatible')
         if self.k == None: self.k = float(metadata['k'])
         if self.b == None: self.b = float(metadata['b'])
+        if self.metadata is not metadata:
+            self.load_doc_length_normalization(metadata)
         self.metadata = metadata
-    
-    def load_posting_list(self, line: str) -> PostingList:
-
-        posting_list = self.posting_class()
-
-        for posting in line.split(' '):
-            doc_id, positions = tuple(posting.split(':'))
-            posting_list.posting_list[doc_id] = [int(position) for position in positions.split(',')]
 
-        return posting_list
\ No newline at end of file
+    def set_doc_lengths(self, lengths: np.ndarray, scale: int = BM25_Ranker.doc_length_scale):
+        super().set_doc_lengths(lengths, scale)
+        self.min_dl_div_avgdl = None
+        self.max_dl_div_avgdl = None
+
+    def load_doc_length_normalization(self, metadata: Dict[str, object]):
+        super().load_doc_length_normalization(metadata)
+        if "doc_lengths" not in metadata:
+            self.min_dl_div_avgdl = min(metadata["doc_length_normalization"].values())
+            self.max_dl_div_avgdl = max(metadata["doc_length_normalization"].values())
+
+    def dl_div_avgdl_range(self) -> Tuple[float, float]:
+        # the whole file is only read by the first query with a boost
+        if self.min_dl_div_avgdl == None:
+            self.min_dl_div_avgdl = float(self.doc_lengths.min() / self.doc_lengths_scale)
+            self.max_dl_div_avgdl = float(self.doc_lengths.max() / self.doc_lengths_scale)
+        return self.min_dl_div_avgdl, self.max_dl_div_avgdl
@@ -7,6 +7,7 @@ from collections import defaultdict
 from typing import DefaultDict, Dict, List, Set, Tuple
 from models.posting_list import PostingList, PostingType
 import math
+from models.ranker import Ranker
 from models.rankers.tf_idf import TF_IDF_Ranker
 
 class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
@@ -25,7 +26,7 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
 
     """
     added attributes to PostingList:
-        - posting_list.tf_weight : Dict[int, float]
+        - posting_list.tf_weight : array of float, parallel to the document ids
     """
 
     def __init__(self, posting_type: PostingType, *args, **kwargs):
@@ -78,8 +79,7 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
             if posting_list == None:
                 term_to_positions[term] = []
             else:
-                positions = posting_list.posting_list.get(doc_id, [])
-                term_to_positions[term] = positions
+                term_to_positions[term] = posting_list.get_positions(doc_id)
 
         # calculate boost
         score = 0
@@ -91,7 +91,7 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
                 score += self.compute_distance(i, term1_positions, j+i+1, term2_positions)
         return math.log10(score) if score > 0 else 0
 
-    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList]) -> List[Tuple[int, float]]:
+    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList], n:int=None) -> List[Tuple[int, float]]:
         tfs = dict()
 
         for token in term_to_posting_list.keys():
@@ -114,10 +114,10 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
             posting_list = term_to_posting_list.get(term)
             if posting_list == None: continue
 
-            docs: List[int] = posting_list.get_documents()
+            idf = self.calculate_idf(posting_list, self.schema[1])
 
-            for doc in docs:
-                lnc = self.calculate_idf(posting_list, self.schema[1]) * posting_list.tf_weight[doc]
+            for doc, tf_weight in zip(posting_list.get_documents(), posting_list.tf_weight):
+                lnc = idf * tf_weight
 
                 scores[doc] += lnc * uniformed_ltc[term]
         
@@ -127,40 +127,9 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
             if boost_score > 0:
                 scores[doc] = tf + self.boost_weight * boost_score
         
-        return sorted(scores.items(), key=lambda i: i[1], reverse=True)
+        return Ranker.top_k(scores, n)
 
 
-    def document_repr(self, posting_list: PostingList):
-        return ' '.join([f"{str(doc_id)}:{','.join([str(position) for position in postings_list])}/{round(posting_list.tf_weight[doc_id], 3)}" for doc_id, postings_list in posting_list.posting_list.items()])
-
-
-    def load_posting_list(self, line: str) -> PostingList:
-        posting_list = self.posting_class()
-        TF_IDF_Ranker.posting_list_init(posting_list)
-
-        parts = line.split('#')
-        posting_list_str = parts[0]
-        if len(parts) > 1:
-            idf = parts[1]
-            posting_list.idf = float(idf)
-
-        for posting in posting_list_str.split(' '):
-            posting_str, weight = tuple(posting.split('/'))
-            doc_id, positions = tuple(posting_str.split(':'))
-            posting_list.posting_list[doc_id] = [int(position) for position in positions.split(',')]
-            posting_list.tf_weight[doc_id] = float(weight)
-
-        return posting_list
-
-    def after_add_tokens(self, term_to_postinglist: Dict[str, PostingList], tokens: List[str], doc_id: int):
-        tfs = self.calculate_tf(doc_id, tokens)
-        uniformed_tfs = TF_IDF_Ranker.uniform_weight(tfs, self.schema[2])
-        for token in tokens:
-            posting_list: PostingList = term_to_postinglist[token]
-            if not hasattr(posting_list, 'tf_weight'):
-                TF_IDF_Ranker.posting_list_init(posting_list)
-            posting_list.tf_weight[doc_id] = uniformed_tfs[token]
-
     def calculate_tf(self, doc_id: int, tokens: List[str]):
         """
         :param position: word position inside document
@@ -191,9 +160,9 @@ class TF_IDF_Positional_Ranker(TF_IDF_Ranker):
     def calculate_idf(self, posting_list: PostingList, alg):
         try:
             if alg == 't':
-                return round(math.log(len(self.documents_length)/len(posting_list.posting_list)), 3)
+                return round(math.log(len(self.documents_length)/len(posting_list)), 3)
             elif alg == 'p':
-                return round(max(0, math.log((len(self.documents_length)-len(posting_list.posting_list))/len(posting_list.posting_list))), 3)
+                return round(max(0, math.log((len(self.documents_length)-len(posting_list))/len(posting_list))), 3)
             elif alg == 'n':
                 return 1
         except ValueError:
@@ -3,7 +3,9 @@
 # Vasco Sousa  - 93049
 
 
+from array import array
 from collections import defaultdict
+from itertools import chain
 from typing import DefaultDict, Dict, List, Set, Tuple
 from models.posting_list import PostingList, PostingListFactory, PostingType
 from models.ranker import Ranker
@@ -22,10 +24,12 @@ class TF_IDF_Ranker(Ranker):
     allowed_posting_types: Set[PostingType] = {
         PostingType.FREQUENCY
     }
+    # the tf weight of each document
+    document_nbytes: int = 8
 
     """
     added attributes to PostingList:
-        - posting_list.tf_weight : Dict[int, float]
+        - posting_list.tf_weight : array of float, parallel to the document ids
     """
 
     def __init__(self, posting_type: PostingType, *args, **kwargs):
@@ -73,7 +77,7 @@ class TF_IDF_Ranker(Ranker):
             'ranker_schema': self.schema
         }
 
-    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList]) -> List[Tuple[int, float]]:
+    def order(self, query:List[str], term_to_posting_list: Dict[str, PostingList], n:int=None) -> List[Tuple[int, float]]:
 
         tfs = dict()
         for token in term_to_posting_list.keys():
@@ -96,14 +100,14 @@ class TF_IDF_Ranker(Ranker):
             posting_list = term_to_posting_list.get(term)
             if posting_list == None: continue
 
-            docs: List[int] = posting_list.get_documents()
+            idf = self.calculate_idf(posting_list, self.schema[1])
 
-            for doc in docs:
-                lnc = self.calculate_idf(posting_list, self.schema[1]) * posting_list.tf_weight[doc]
+            for doc, tf_weight in zip(posting_list.get_documents(), posting_list.tf_weight):
+                lnc = idf * tf_weight
 
                 scores[doc] += lnc * uniformed_ltc[term]
         
-        return sorted(scores.items(), key=lambda i: i[1], reverse=True)
+        return Ranker.top_k(scores, n)
 
     def merge_calculations(self, posting_list: PostingList):
         posting_list.idf = self.calculate_idf(posting_list, self.schema[5])
@@ -112,41 +116,83 @@ class TF_IDF_Ranker(Ranker):
         return str(posting_list.idf)
 
     def document_repr(self, posting_list: PostingList):
-        return ' '.join([f'{doc_id}:{freq}/{round(posting_list.tf_weight[doc_id], 3)}' for doc_id, freq in posting_list.posting_list.items()])
+        # the weight goes after each posting of the posting list representation
+        return ' '.join([f'{posting}/{round(tf_weight, 3)}' for posting, tf_weight in zip(str(posting_list).split(' '), posting_list.tf_weight)])
+
+    def document_block(self, posting_list: PostingList) -> object:
+        return (posting_list.to_block(), posting_list.tf_weight)
+
+    def slice_posting_list(self, posting_list: PostingList, start: int, end: int) -> PostingList:
+        new_posting_list = posting_list.slice(start, end)
+        new_posting_list.tf_weight = posting_list.tf_weight[start:end]
+        return new_posting_list
 
     def term_repr(self, posting_list: PostingList):
         return f'{self.document_repr(posting_list)}'
 
+    def term_bytes(self, posting_list: PostingList, previous_doc_id: int = 0) -> bytes:
+        # the weights are kept with 3 decimal places like in the text representation, after the postings and in the same order
+        weights = [round(tf_weight*1000) for tf_weight in posting_list.tf_weight]
+        return PostingList.encode_vbyte(posting_list.to_gaps(previous_doc_id) + weights)
+
     @staticmethod
     def posting_list_init(posting_list: PostingList):
-        posting_list.tf_weight = defaultdict(int)
+        posting_list.tf_weight = array('d')
 
     def load_posting_list(self, line: str) -> PostingList:
-        posting_list = self.posting_class()
-        TF_IDF_Ranker.posting_list_init(posting_list)
-
         parts = line.split('#')
-        posting_list_str = parts[0]
-        if len(parts) > 1:
-            idf = parts[1]
-            posting_list.idf = float(idf)
 
-        for posting in posting_list_str.split(' '):
+        postings = []
+        tf_weight = array('d')
+        for posting in parts[0].split(' '):
             posting_str, weight = tuple(posting.split('/'))
-            doc_id, freq = tuple(posting_str.split(':'))
-            posting_list.posting_list[doc_id] = int(freq)
-            posting_list.tf_weight[doc_id] = float(weight)
-        
+            postings.append(posting_str)
+            tf_weight.append(float(weight))
+
+        posting_list = self.posting_class.load(' '.join(postings))
+        posting_list.tf_weight = tf_weight
+        if len(parts) > 1:
+            posting_list.idf = float(parts[1])
+
+        return posting_list
+
+    def merge_posting_lists(self, posting_list_class: PostingList.__class__, posting_lists: List[PostingList]) -> PostingList:
+        # the documents are concatenated in the order of the given posting lists, and so are their weights
+        tf_weight = array('d', chain.from_iterable(posting_list.tf_weight for posting_list in posting_lists))
+        new_posting_list = posting_list_class.merge(posting_lists)
+        new_posting_list.tf_weight = tf_weight
+        return new_posting_list
+
+    def export_state(self) -> Dict[str, object]:
+        # hand over the documents length gathered so far and start again, used to combine parallel indexers
+        state = { 'documents_length': self.documents_length }
+        self.documents_length = defaultdict(int)
+        return state
+
+    def import_state(self, state: Dict[str, object]):
+        self.documents_length.update(state['documents_length'])
+
+    def load_posting_list_bytes(self, data: bytes, previous_doc_id: int = 0) -> PostingList:
+        numbers = PostingList.decode_vbyte(data)
+        posting_list, end = self.posting_class.from_gaps(numbers, previous_doc_id=previous_doc_id)
+        posting_list.tf_weight = array('d', [weight/1000 for weight in numbers[end:]])
+        return posting_list
+
+    def load_posting_list_block(self, data: object) -> PostingList:
+        posting_list_data, tf_weight = data
+        posting_list = self.posting_class.from_block(posting_list_data)
+        posting_list.tf_weight = tf_weight
         return posting_list
 
     def after_add_tokens(self, term_to_postinglist: Dict[str, PostingList], tokens: List[str], doc_id: int):
         tfs = self.calculate_tf(doc_id, tokens)
         uniformed_tfs = TF_IDF_Ranker.uniform_weight(tfs, self.schema[2])
-        for token in tokens:
+        for token, tf_weight in uniformed_tfs.items():
             posting_list: PostingList = term_to_postinglist[token]
             if not hasattr(posting_list, 'tf_weight'):
                 TF_IDF_Ranker.posting_list_init(posting_list)
-            posting_list.tf_weight[doc_id] = uniformed_tfs[token]
+            # the document was the last one added to the posting list
+            posting_list.tf_weight.append(tf_weight)
 
     def calculate_tf(self, doc_id: int, tokens: List[str]):
         """
@@ -178,9 +224,9 @@ class TF_IDF_Ranker(Ranker):
     def calculate_idf(self, posting_list: PostingList, alg):
         try:
             if alg == 't':
-                return round(math.log(len(self.documents_length)/len(posting_list.posting_list)), 3)
+                return round(math.log(len(self.documents_length)/len(posting_list)), 3)
             elif alg == 'p':
-                return round(max(0, math.log((len(self.documents_length)-len(posting_list.posting_list))/len(posting_list.posting_list))), 3)
+                return round(max(0, math.log((len(self.documents_length)-len(posting_list))/len(posting_list))), 3)
             elif alg == 'n':
                 return 1
         except ValueError:
@@ -0,0 +1,48 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from contextlib import contextmanager
+import threading
+from typing import Iterator
+
+
+class ReadWriteLock:
+    """
+    Lock shared by any number of readers or held by a single writer, the writer waits until every reader is done.
+    A thread that is reading can read again, so the readers are never blocked by a writer that is only waiting
+    """
+    condition: threading.Condition
+    readers: int
+    writing: bool
+
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self.condition:
+            while self.writing:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0: self.condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self.condition:
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
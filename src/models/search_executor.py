@@ -0,0 +1,134 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import math
+import os
+import threading
+from typing import Dict, List, Tuple
+from models.index import InvertedIndex
+from models.posting_list import PostingType
+from models.ranker import RankerFactory, RankingMethod
+from models.tokenizer import Tokenizer
+
+
+# index, ranker and tokenizer of each worker process, loaded once when the process starts
+worker_state: Dict[str, object] = dict()
+
+
+def init_worker(index_file: str, use_mmap: bool, cache_bytes: int, ranker_kwargs: Dict[str, object]) -> None:
+    index = InvertedIndex(None, output_path=index_file, use_mmap=use_mmap, cache_bytes=cache_bytes)
+    worker_state['index'] = index
+    worker_state['ranker'] = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']), **ranker_kwargs)
+    worker_state['tokenizer'] = Tokenizer(index.metadata['min_token_length'], index.metadata['stop_words'], index.metadata['language'])
+
+
+def cache_stats() -> Tuple[int, Dict[str, int]]:
+    # sent with the results, the tasks can not be sent to a given worker to ask for them
+    return os.getpid(), worker_state['index'].posting_list_cache.stats()
+
+
+def search_chunk(queries: List[str], n: int) -> Tuple[List[List[Tuple[str, float]]], Tuple[int, Dict[str, int]]]:
+    index: InvertedIndex = worker_state['index']
+    tokenizer: Tokenizer = worker_state['tokenizer']
+    results = index.search_batch([tokenizer.tokenize(query) for query in queries], n, worker_state['ranker'], show_score=True)
+    # the worker reloads the index on its own, so the real doc ids are read from the same index that ranked the queries
+    doc_id_to_real_doc_id = index.fetch_doc_ids(sorted(set(int(doc_id) for query_results in results for doc_id, _ in query_results)))
+    return [[(doc_id_to_real_doc_id[int(doc_id)], float(score)) for doc_id, score in query_results] for query_results in results], cache_stats()
+
+
+def search_tokens(tokens: List[str], n: int) -> Tuple[Tuple[Tuple[int, int, int]], List[Tuple[str, float]], Tuple[int, Dict[str, int]]]:
+    index: InvertedIndex = worker_state['index']
+    results = index.search(tokens, n, worker_state['ranker'], show_score=True)
+    doc_id_to_real_doc_id = index.fetch_doc_ids([int(doc_id) for doc_id, _ in results])
+    # the index is only reloaded when a search starts, so the version is the one of the index that ranked the query
+    return index.version, [(doc_id_to_real_doc_id[int(doc_id)], float(score)) for doc_id, score in results], cache_stats()
+
+
+class SearchExecutor:
+    """
+    Search queries in a pool of worker processes, each one opens the index read only so the index files are shared through the page cache and the ranking is not limited by the GIL
+    """
+    executor: ProcessPoolExecutor
+    processes: int
+    chunk_size: int
+    # counters of the posting list cache of each worker process after its last task
+    worker_stats: Dict[int, Dict[str, int]]
+    lock: threading.Lock
+
+    def __init__(self, index_file: str, processes: int = None, chunk_size: int = None, use_mmap: bool = False, cache_bytes: int = None, **ranker_kwargs) -> None:
+        """
+        :param index_file: path to the index file
+        :param processes: number of worker processes, the number of CPUs when None
+        :param chunk_size: number of queries sent to a worker at a time, by default the queries are split in 4 chunks per worker
+        :param use_mmap: memory map the index files in the workers
+        :param cache_bytes: memory budget of the posting list cache of each worker
+        :param ranker_kwargs: parameters of the ranker, like dynamic_pruning
+        """
+        self.processes = processes if processes != None else os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker, initargs=(index_file, use_mmap, cache_bytes, ranker_kwargs))
+        self.chunk_size = chunk_size
+        self.worker_stats = dict()
+        self.lock = threading.Lock()
+
+    def search(self, queries: List[str], n: int) -> List[List[Tuple[int, float]]]:
+        """
+        Split the queries in chunks searched by the workers with InvertedIndex.search_batch()
+
+        :param queries: text of each query
+        :param n: number of results of each query
+        :return: real doc id and score of the results of each query, in the order of the queries
+        """
+        if len(queries) == 0: return []
+        chunk_size = self.chunk_size if self.chunk_size != None else math.ceil(len(queries) / (self.processes * 4))
+        chunks = [queries[start:start + chunk_size] for start in range(0, len(queries), chunk_size)]
+        results = []
+        # map returns the chunks in the order they were given
+        for chunk_results, stats in self.executor.map(search_chunk, chunks, repeat(n)):
+            results.extend(chunk_results)
+            self.save_stats(stats)
+        return results
+
+    def search_tokens(self, tokens: List[str], n: int) -> Tuple[Tuple[Tuple[int, int, int]], List[Tuple[str, float]]]:
+        """
+        Rank a query already tokenized in one of the workers, for the searches that arrive one at a time
+
+        :param tokens: tokens of the query
+        :param n: number of results
+        :return: version of the index files of the worker and the real doc id and score of the results
+        """
+        version, results, stats = self.executor.submit(search_tokens, tokens, n).result()
+        self.save_stats(stats)
+        return version, results
+
+    def save_stats(self, stats: Tuple[int, Dict[str, int]]) -> None:
+        pid, cache_stats = stats
+        with self.lock:
+            self.worker_stats[pid] = cache_stats
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Counters of the posting list caches of the workers, as they were after the last task of each one
+
+        :return: sum of the counters of every worker and the counters of each one by process id
+        """
+        with self.lock:
+            workers = {pid: dict(stats) for pid, stats in self.worker_stats.items()}
+        total = dict()
+        for stats in workers.values():
+            for name, value in stats.items():
+                # max_bytes is None when the caches are not bounded
+                total[name] = None if value == None or total.get(name, 0) == None else total.get(name, 0) + value
+        return {'total': total, 'workers': workers}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self) -> SearchExecutor:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
@@ -0,0 +1,157 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+import math
+import struct
+import sys
+from typing import Callable, Dict, List
+import numpy as np
+from models.posting_list import PostingList
+
+
+class SkipPostingList:
+    """
+    Posting list written in blocks of a fixed number of documents, each block is encoded on its own and has a skip entry with its last doc id, its highest score and its length.
+    Only the skip entries are decoded when the posting list is loaded, the blocks are decoded when they are needed.
+    """
+    # the highest scores are saved as integers rounded up to 3 decimal places
+    score_precision: int = 1000
+    header_struct: struct.Struct = struct.Struct('<I')
+
+    data: bytes
+    # last doc id, highest score and start inside data of each block, the offsets have one more entry with the end of the last block
+    last_doc_ids: np.ndarray
+    max_scores: np.ndarray
+    offsets: List[int]
+    blocks: Dict[int, PostingList]
+    posting_list: PostingList
+    load_block: Callable[[bytes, int], PostingList]
+    merge: Callable[[List[PostingList]], PostingList]
+    tiny: object
+
+    def __init__(self, data:bytes, load_block:Callable[[bytes, int], PostingList], merge:Callable[[List[PostingList]], PostingList]):
+        """
+        :param data: skip entries and blocks written by encode()
+        :param load_block: decodes the bytes of one block, given the last doc id of the previous block
+        :param merge: joins the blocks in order into the whole posting list
+        """
+        self.data = data
+        self.load_block = load_block
+        self.merge = merge
+        self.blocks = dict()
+        self.posting_list = None
+
+        header_length, = SkipPostingList.header_struct.unpack_from(data)
+        header_end = SkipPostingList.header_struct.size + header_length
+        numbers = PostingList.decode_vbyte(data[SkipPostingList.header_struct.size:header_end])
+        self.last_doc_ids = np.cumsum(numbers[0::3], dtype=np.int64).astype(np.uint32)
+        self.max_scores = np.array(numbers[2::3], dtype=np.float64) / SkipPostingList.score_precision
+        self.offsets = [header_end]
+        for length in numbers[1::3]:
+            self.offsets.append(self.offsets[-1] + length)
+
+    @staticmethod
+    def encode(blocks:List[bytes], last_doc_ids:List[int], max_scores:List[float]) -> bytes:
+        """
+        Join the encoded blocks behind their skip entries, which have the gap between the last doc ids, the length and the highest score of each block in variable byte encoding
+
+        :param blocks: encoded blocks in doc id order, the first gap of each block is from the last doc id of the previous one
+        :param last_doc_ids: last doc id of each block
+        :param max_scores: highest score of each block
+        :return: bytes of the posting list
+        """
+        numbers = []
+        previous_doc_id = 0
+        for block, last_doc_id, max_score in zip(blocks, last_doc_ids, max_scores):
+            numbers.append(last_doc_id - previous_doc_id)
+            numbers.append(len(block))
+            # rounded up so it stays an upper bound
+            numbers.append(math.ceil(max_score * SkipPostingList.score_precision))
+            previous_doc_id = last_doc_id
+        header = PostingList.encode_vbyte(numbers)
+        return SkipPostingList.header_struct.pack(len(header)) + header + b''.join(blocks)
+
+    @staticmethod
+    def from_posting_list(posting_list:PostingList, max_score:float) -> SkipPostingList:
+        """
+        Posting list already decoded seen as a single block, so it can be used where a skip posting list is expected
+
+        :param posting_list: whole posting list
+        :param max_score: highest score of the posting list
+        :return: skip posting list with one block
+        """
+        skip_posting_list = SkipPostingList.__new__(SkipPostingList)
+        skip_posting_list.data = None
+        skip_posting_list.last_doc_ids = np.array([posting_list.get_documents()[-1]], dtype=np.uint32)
+        skip_posting_list.max_scores = np.array([max_score])
+        skip_posting_list.offsets = [0, 0]
+        skip_posting_list.blocks = {0: posting_list}
+        skip_posting_list.posting_list = posting_list
+        skip_posting_list.tiny = getattr(posting_list, 'tiny', None)
+        return skip_posting_list
+
+    def __len__(self) -> int:
+        return len(self.last_doc_ids)
+
+    def nbytes(self) -> int:
+        """
+        Memory taken by the encoded data, the skip entries and the blocks decoded so far
+
+        :return: size in bytes
+        """
+        size = sys.getsizeof(self) + self.last_doc_ids.nbytes + self.max_scores.nbytes + sys.getsizeof(self.offsets)
+        if self.data != None: size += sys.getsizeof(self.data)
+        decoded = {id(block): block for block in list(self.blocks.values())}
+        if self.posting_list != None: decoded[id(self.posting_list)] = self.posting_list
+        return size + sum(block.nbytes() for block in decoded.values())
+
+    def block(self, i:int) -> PostingList:
+        """
+        Decode a block, the decoded blocks are kept
+
+        :param i: block index
+        :return: posting list with the documents of the block
+        """
+        block = self.blocks.get(i)
+        if block == None:
+            block = self.load_block(self.data[self.offsets[i]:self.offsets[i+1]], self.previous_doc_id(i))
+            self.blocks[i] = block
+        return block
+
+    def previous_doc_id(self, i:int) -> int:
+        return int(self.last_doc_ids[i-1]) if i > 0 else 0
+
+    def find_blocks(self, doc_ids:np.ndarray) -> np.ndarray:
+        """
+        Block where each document would be, by binary search over the last doc ids
+
+        :param doc_ids: doc ids in increasing order
+        :return: block index of each document, the number of blocks for the ones after the last block
+        """
+        return np.searchsorted(self.last_doc_ids, doc_ids)
+
+    def block_max_scores(self, doc_ids:np.ndarray) -> np.ndarray:
+        """
+        Highest score of the block where each document would be
+
+        :param doc_ids: doc ids in increasing order
+        :return: upper bound of the score of each document, 0 for the ones after the last block
+        """
+        blocks = self.find_blocks(doc_ids)
+        return np.append(self.max_scores, 0)[blocks]
+
+    def decode(self) -> PostingList:
+        """
+        Decode every block into the whole posting list, it is kept for the next calls
+
+        :return: the whole posting list
+        """
+        if self.posting_list == None:
+            # new block objects because the merge extends the first one
+            blocks = [self.load_block(self.data[self.offsets[i]:self.offsets[i+1]], self.previous_doc_id(i)) for i in range(len(self))]
+            self.posting_list = self.merge(blocks)
+            self.posting_list.tiny = getattr(self, 'tiny', None)
+            self.blocks.clear()
+        return self.posting_list
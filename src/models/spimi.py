@@ -2,97 +2,221 @@
 # Tiago Rainho - 92984
 # Vasco Sousa  - 93049
 
-from io import FileIO
+from __future__ import annotations
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import Enum
+import io
+from itertools import takewhile
 from typing import Dict, Generator, List, Tuple
 from models.index import InvertedIndex
 from models.posting_list import PostingList, PostingListFactory, PostingType
 from models.ranker import Ranker
+from models.term_dictionary import TermDictionary
 from pathlib import Path
-import threading
-import psutil
 import heapq
 import os
 import glob
+import shutil
+import sys
+
+class BlockFormat(Enum):
+    TEXT = 'text'
+    BINARY = 'binary'
+
+
+# terms, start of each term, tiny representations, start of each one, offsets, lengths and document frequencies of the posting lists
+DictionaryEntries = Tuple[bytes, array, bytes, array, array, array, array]
+
 
 class Spimi():
     AUXILIARY_DIR: str
     BLOCK_SUFFIX: str
+    RUN_SUFFIX: str
+    block_prefix: str
     MAX_BLOCK_SIZE: int
-    MAX_RAM_USAGE: int
+    MAX_BLOCK_BYTES: int or None
     block_number: int
+    # maximum number of blocks merged at once, the others wait for the next pass
+    merge_fan_in: int
+    # memory of the read buffers of a merge, split between the blocks merged at once
+    merge_buffer_bytes: int
+    # processes that merge a range of terms each in the final merge
+    merge_processes: int
+    # terms at the head of equal slices of every block written, used to split the terms in ranges of about the same size
+    term_samples: List[str]
+    samples_per_block: int = 16
+    # merge the blocks into runs in another process while the documents are still being added
+    background_merge: bool
+    # blocks and runs not merged yet in the order of their documents, level 0 has the blocks and each level the runs of merge_fan_in items of the one below
+    merge_levels: List[List[Path]]
+    merge_executor: ProcessPoolExecutor or None
+    background_merges: List[Future]
+    block_format: BlockFormat
+    compress: bool
+    skip_block_size: int
     inverted_index: InvertedIndex
     posting_list_class: PostingList
     posting_type: PostingType
     ranker: Ranker
     metadata: Dict[str, object]
-    ram_usage: float
-    can_update_ram: threading.Event
-    document_done: threading.Event
-
-    def __init__(self, ranker: Ranker = None, posting_type: PostingType = PostingType.FREQUENCY, max_ram_usage: int = 85, max_block_size: int = 10000, auxiliary_dir: str = 'cache/blocks') -> None:
+    # estimated memory taken by the terms and posting lists of the current block
+    block_bytes: int
+    # estimated memory of a new term without its string, the empty posting list and the entry in the dictionary
+    term_nbytes: int
+    document_nbytes: int
+    position_nbytes: int
+
+    def __init__(self, ranker: Ranker = None, posting_type: PostingType = PostingType.FREQUENCY, max_block_bytes: int = None, max_block_size: int = 10000, auxiliary_dir: str = 'cache/blocks', block_format: BlockFormat = BlockFormat.TEXT, compress: bool = False, skip_block_size: int = 0, merge_fan_in: int = 64, merge_buffer_bytes: int = 64 * 1024 * 1024, merge_processes: int = 1, background_merge: bool = False) -> None:
         """
         Creates a new instance of a SPIMI indexer, this is used to create indexes and initialize static variables
 
+        :param max_block_bytes: estimated memory in bytes of the terms in memory before writing them to a block, without limit when None
+        :param max_block_size: maximum number of terms in memory before writing them to a block
+        :param merge_fan_in: maximum number of blocks merged at once, the blocks are merged in several passes when there are more (0 to merge all at once)
+        :param merge_buffer_bytes: memory of the read buffers of each merge, split between the blocks merged at once
+        :param merge_processes: number of processes of the final merge, each one merges a range of terms
+        :param background_merge: merge every merge_fan_in blocks written into a run in another process while indexing, needs a merge_fan_in of at least 2
         :return: None
         """
         self.metadata = dict()
         self.MAX_BLOCK_SIZE = max_block_size
-        self.MAX_RAM_USAGE = max_ram_usage
+        self.MAX_BLOCK_BYTES = max_block_bytes
         self.AUXILIARY_DIR = auxiliary_dir
         self.BLOCK_SUFFIX = 'block'
+        self.RUN_SUFFIX = 'run'
+        self.block_prefix = ''
         self.block_number = 0
+        self.merge_fan_in = merge_fan_in
+        self.merge_buffer_bytes = merge_buffer_bytes
+        self.merge_processes = merge_processes
+        self.term_samples = []
+        self.background_merge = background_merge and merge_fan_in > 1
+        self.merge_levels = [[]]
+        self.merge_executor = None
+        self.background_merges = []
+        self.block_format = block_format
+        # the posting lists split in blocks with skip entries are always compressed
+        self.compress = compress or skip_block_size > 0
+        self.skip_block_size = skip_block_size
         self.inverted_index = InvertedIndex(dict(), posting_type)
         self.posting_type = posting_type
         self.posting_list_class = PostingListFactory(posting_type)
         self.ranker = ranker if ranker != None else Ranker(posting_type)
         self.extend_metadata(self.ranker.metadata())
+        if self.compress:
+            self.extend_metadata({ 'posting_encoding': 'vbyte' })
+        if skip_block_size > 0:
+            self.extend_metadata({ 'skip_block_size': skip_block_size })
+
+        self.block_bytes = 0
+        # the entry of the dictionary is about 3 pointers
+        self.term_nbytes = self.posting_list_class().nbytes() + 24
+        self.document_nbytes = self.posting_list_class.document_nbytes + self.ranker.document_nbytes
+        self.position_nbytes = self.posting_list_class.position_nbytes
+
+    def __getstate__(self) -> Dict[str, object]:
+        # sent to the merge processes after the last block was written, so the terms in memory are not needed
+        state = self.__dict__.copy()
+        for name in ('inverted_index', 'merge_executor', 'background_merges'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        self.__dict__.update(state)
+        self.inverted_index = InvertedIndex(dict(), self.posting_type)
+        self.merge_executor = None
+        self.background_merges = []
 
-        self.ram_usage = self.get_ram_usage()
-        self.can_update_ram = threading.Event()
-        self.document_done = threading.Event()
-        self.document_done.set()
-        self.can_update_ram.set()
-        thread = threading.Thread(target=self.update_ram, daemon=True)
-        thread.start()
-
-
-    
     def extend_metadata(self, dictionary: Dict[str, object]):
         for key, value in dictionary.items():
             if key in self.metadata:
                 raise Exception(f'"{key}" already exists in the metadata')
             self.metadata[key] = value
 
-    def get_ram_usage(self):
-        return psutil.virtual_memory().percent
-
-    def update_ram(self):
-        while True:
-            self.can_update_ram.wait()
-            self.document_done.clear()
-            self.ram_usage = self.get_ram_usage()
-            self.document_done.set()
-
     def add_document(self, doc_id: int, tokens: List[str]) -> None:
         """
-        Add a new document to be indexed. The indexing takes into account memory usage and created index size
+        Add a new document to be indexed. The block is written when it has too many terms or its estimated memory reaches the budget
 
         :param doc_id: document ID
         :param tokens: list of tokens from the document
         :return: None
         """
-        self.can_update_ram.set()
-
         self.ranker.before_add_tokens(self.inverted_index.inverted_index, tokens, doc_id)
-        self.inverted_index.add_tokens(tokens, doc_id)
+        new_terms = self.inverted_index.add_tokens(tokens, doc_id)
         self.ranker.after_add_tokens(self.inverted_index.inverted_index, tokens, doc_id)
 
-        self.can_update_ram.clear()
-        self.document_done.wait()
+        # every term of the document gets one more document and every token one more position
+        self.block_bytes += len(new_terms) * self.term_nbytes + sum(map(sys.getsizeof, new_terms)) \
+            + len(set(tokens)) * self.document_nbytes + len(tokens) * self.position_nbytes
+
+        if self._inverted_index_size >= self.MAX_BLOCK_SIZE or (self.MAX_BLOCK_BYTES != None and self.block_bytes >= self.MAX_BLOCK_BYTES):
+            self.flush_block()
+
+    def flush_block(self) -> None:
+        """
+        Write the terms currently in memory to a new block and clear them, nothing is written when there are no terms
 
-        if(self._inverted_index_size >= self.MAX_BLOCK_SIZE or self.ram_usage >= self.MAX_RAM_USAGE):
-            self._write_block_to_disk(f"{self.AUXILIARY_DIR}/{self.block_number}.{self.BLOCK_SUFFIX}")
+        :return: None
+        """
+        if self._inverted_index_size > 0:
+            self._write_block_to_disk(f"{self.AUXILIARY_DIR}/{self.block_prefix}{self.block_number}.{self.BLOCK_SUFFIX}")
             self.inverted_index.clear()
+            self.block_bytes = 0
+            self.schedule_merges()
+
+    def add_blocks(self, block_paths: List[Path]) -> None:
+        """
+        Add blocks written by another indexer, like the indexing workers, they must be added in the order of their documents
+
+        :param block_paths: blocks written
+        :return: None
+        """
+        self.block_number += len(block_paths)
+        self.merge_levels[0].extend(block_paths)
+        self.schedule_merges()
+
+    def schedule_merges(self) -> None:
+        """
+        Send every group of merge_fan_in consecutive items of a level to the background merge, the run goes to the level above.
+        The runs are merged one at a time in the order they are sent, so the runs of a level are done before the ones that merge them
+
+        :return: None
+        """
+        if not self.background_merge:
+            return
+        level = 0
+        while level < len(self.merge_levels):
+            while len(self.merge_levels[level]) >= self.merge_fan_in:
+                group = self.merge_levels[level][:self.merge_fan_in]
+                del self.merge_levels[level][:self.merge_fan_in]
+                if level + 1 == len(self.merge_levels):
+                    self.merge_levels.append([])
+                run_path = Path(f"{self.AUXILIARY_DIR}/background_{level}_{self.block_prefix}{len(self.background_merges)}.{self.RUN_SUFFIX}").resolve()
+                if self.merge_executor == None:
+                    self.merge_executor = ProcessPoolExecutor(1, initializer=init_merge_worker, initargs=(self,))
+                self.background_merges.append(self.merge_executor.submit(write_background_run, group, run_path))
+                self.merge_levels[level + 1].append(run_path)
+            level += 1
+
+    def wait_background_merges(self) -> List[Path]:
+        """
+        Wait for the runs sent to the background merge
+
+        :return: blocks and runs not merged yet, in the order of their documents
+        """
+        for future in self.background_merges:
+            # raises the errors of the background merge
+            future.result()
+        if self.merge_executor != None:
+            self.merge_executor.shutdown()
+            self.merge_executor = None
+        self.background_merges = []
+        # the higher levels have the first documents
+        input_paths = [path for level in reversed(self.merge_levels) for path in level]
+        self.merge_levels = [[]]
+        return input_paths
 
     @property
     def _inverted_index_size(self) -> int:
@@ -110,103 +234,165 @@ class Spimi():
         :param output_file: file to write the index
         :return: None
         """
-        self.inverted_index.save(Path(output_path).resolve(), self.ranker)
+        terms = self.inverted_index.sorted_terms()
+        term_posting_lists = ((term, self.inverted_index.inverted_index[term]) for term in terms)
+        if self.block_format == BlockFormat.BINARY:
+            self.inverted_index.write_pages(Path(output_path).resolve(), term_posting_lists, self.ranker)
+        else:
+            self.inverted_index.write_lines(Path(output_path).resolve(), term_posting_lists, self.ranker)
+        self.term_samples.extend(terms[::max(len(terms) // self.samples_per_block, 1)])
+        self.merge_levels[0].append(Path(output_path).resolve())
         self.block_number += 1
 
-    def get_lines_from_block(self, file: FileIO) -> List[str]:
+    def decode_entry(self, entry: object) -> PostingList:
         """
-        reads lines from a file IO based on the MAX_USAGE_BLOCK variable
+        Parses the posting list of a line of text without its term, or of the data of a binary record, depending on the block format
 
-        :param file: file io which means it is already opened
-        :return: list of at most MAX_USAGE_BLOCK strings read by the file, otherwise divide the MAX_USAGE_BLOCK by the number of blocks to read
+        :param entry: rest of the line after the term or data of the record
+        :return: PostingList
         """
-        return [file.readline().replace('\n', '') for _ in range(int(self.MAX_BLOCK_SIZE/self.block_number))]
+        if self.block_format == BlockFormat.BINARY:
+            return self.ranker.load_posting_list_block(entry)
+        return self.ranker.load_posting_list(entry)
 
-    def load_line(self, line) -> Tuple[str, PostingList]:
+    def file_generator(self, file: str, buffer_size: int = io.DEFAULT_BUFFER_SIZE, low: str = None, high: str = None) -> Generator[List[str], None, None]:
         """
-        Parses the term and posting list from a line of text
+        Abstracts the lines access of the given file as a generator. When it is done, closes the file access
 
-        :param line: line to be parsed
-        :return: Tuple of term and PostingList
+        :param file: file from which to read the lines
+        :param buffer_size: bytes read from the file at a time, the lines are read until they fill it
+        :param low: first term to read, from the start of the file when None
+        :param high: term at which the reading stops, until the end of the file when None
+        :return: list of strings, or a page of binary records when using the binary block format
         """
-        return self.inverted_index.load(line, self.ranker)
+        if self.block_format == BlockFormat.BINARY:
+            with open(file, 'rb', buffering=buffer_size) as file_io:
+                while True:
+                    records = self.inverted_index.read_page(file_io)
+                    if records == []:
+                        break
+                    # the pages can not be found without reading them, the ones before the range are skipped
+                    if low != None and records[0][0] < low:
+                        records = [record for record in records if record[0] >= low]
+                        if records == []: continue
+                    if high != None and records[-1][0] >= high:
+                        records = [record for record in records if record[0] < high]
+                        if records != []: yield records
+                        break
+                    yield records
+            return
+
+        delimiter = self.inverted_index.delimiter
+        start = 0
+        if low != None:
+            with open(file, 'rb') as file_io:
+                start = Spimi.seek_term(file_io, low, delimiter)
+        with open(file, buffering=buffer_size) as file_io:
+            # the position of a line start is a valid position of the text file
+            file_io.seek(start)
+            while True:
+                lines = [line[:-1] for line in file_io.readlines(buffer_size)]
+                if lines == []:
+                    break
+                if high != None and lines[-1].partition(delimiter)[0] >= high:
+                    lines = list(takewhile(lambda line: line.partition(delimiter)[0] < high, lines))
+                    if lines != []: yield lines
+                    break
+                yield lines
 
-    def file_generator(self, file: str) -> Generator[List[str], None, None]:
+    @staticmethod
+    def seek_term(file: io.BufferedReader, term: str, delimiter: str = ' ') -> int:
         """
-        Abstracts the lines access of the given file as a generator. When it is done, closes the file access
+        Binary search of the first line of a text block whose term is not lower than the given one, the lines are found from any position by skipping to the next one
 
-        :param file: file from which to read the lines
-        :return: list of strings
+        :param file: block opened in binary mode
+        :param term: term to find
+        :param delimiter: character after the term of each line
+        :return: position of the line, or the size of the file when every term is lower
         """
-        file_io = open(file)
-        while True:
-            lines = [line for line in self.get_lines_from_block(
-                file_io) if line != '']
-            if lines == []:
-                break
-            yield lines
-        file_io.close()
-
-    def min_k_merge_generator(self, files: List[str]) -> Generator[Tuple[str, PostingList], None, None]:
+        # the terms are sorted by their code points which is the order of their utf-8 bytes
+        key = term.encode('utf-8')
+        delimiter = delimiter.encode('utf-8')
+
+        def line_start(position: int) -> int:
+            # start of the first line at or after position
+            if position == 0: return 0
+            file.seek(position - 1)
+            file.readline()
+            return file.tell()
+
+        low, high = 0, file.seek(0, os.SEEK_END)
+        while low < high:
+            middle = (low + high) // 2
+            file.seek(line_start(middle))
+            line = file.readline()
+            if line == b'' or line.partition(delimiter)[0] >= key:
+                high = middle
+            else:
+                low = middle + 1
+        return line_start(low)
+
+    def merge_entries(self, files: List[str], low: str = None, high: str = None) -> Generator[Tuple[str, List[object]], None, None]:
         """
-        Provide an abstraction to get the minimum term of a set of files. The abstraction choosen was the generator abstraction. The sorting proccess is fast because already done comparisons dont go to waste as it forms a tree data structure
+        Get the terms of a set of sorted files in order, each one with its entries in the files still undecoded, so the posting lists are only parsed when they are merged.
+        The heap has tuples of the term, the position of the file and the entry, compared by the term and then by the file like heapq.merge(), so the entries of a term come in the order of the files
 
         :param files: list of files from which to get the values
-        :return: a tuple with the mininum valued term and its posting lists as it comes in the files
+        :param low: first term to merge, from the first term of the files when None
+        :param high: term at which the merge stops, until the last term of the files when None
+        :return: a tuple with the minimum valued term and its entries in the order of the files, the rest of the lines after the term or the data of the binary records
         """
-        generators = [(file, self.file_generator(file)) for file in files]
-
-        # generators buffer
-        lines_buffer = []
-        for generator in generators:
-            try:
-                lines = next(generator[1])
-                lines_buffer.append(lines)
-            except StopIteration:
-                pass
-
-        # create heap
-        heap: List[Node] = []
-        for i, line in enumerate(lines_buffer):
-            first_line = line.pop(0)
-            first_term, first_posting_list = self.load_line(first_line)
-            heap.append(Node(first_term, first_posting_list, i))
+        # the read buffers of the merge are split between the files, each one is read sequentially in large chunks
+        buffer_size = max(self.merge_buffer_bytes // max(len(files), 1), io.DEFAULT_BUFFER_SIZE)
+        generators = [self.file_generator(file, buffer_size, low, high) for file in files]
+        # the files without terms in the range keep an empty buffer, so the buffers stay in the order of the generators
+        buffers = [deque(next(generator, ())) for generator in generators]
+
+        if self.block_format == BlockFormat.BINARY:
+            def heap_entry(record: Tuple[str, object], i: int) -> Tuple[str, int, object]:
+                return (record[0], i, record[1])
+        else:
+            delimiter = self.inverted_index.delimiter
+            def heap_entry(line: str, i: int) -> Tuple[str, int, object]:
+                term, _, rest = line.partition(delimiter)
+                return (term, i, rest)
+
+        heap = [heap_entry(buffer.popleft(), i) for i, buffer in enumerate(buffers) if len(buffer) > 0]
         heapq.heapify(heap)
 
-        # merge documents until there is none left
+        heapreplace, heappop = heapq.heapreplace, heapq.heappop
         while len(heap) > 0:
-            smallest_node = heapq.heappop(heap)
-            smallest_nodes = [smallest_node]
-
-            # add the rest of postings of the same term but different blocks
-            while len(heap) > 0:
-                node = heap[0]
-                if node.term == smallest_node.term:
-                    smallest_nodes.append(heapq.heappop(heap))
+            term = heap[0][0]
+            entries = []
+            # take the entries of the same term, each one replaced by the next entry of its file which has a greater term
+            while len(heap) > 0 and heap[0][0] == term:
+                _, i, entry = heap[0]
+                entries.append(entry)
+                buffer = buffers[i]
+                if len(buffer) == 0:
+                    buffer.extend(next(generators[i], ()))
+                if len(buffer) > 0:
+                    heapreplace(heap, heap_entry(buffer.popleft(), i))
                 else:
-                    break
+                    heappop(heap)
+            yield term, entries
 
-            # merge posting lists from different blocks and yield the result
-            merged_posting_list = self.posting_list_class.merge(
-                [smallest_node.posting_list for smallest_node in smallest_nodes])
-            yield (smallest_node.term, merged_posting_list)
-
-            for node in smallest_nodes:
-                # repopulate lines_buffer when is empty
-                buffer = lines_buffer[node.block_id]
-                if buffer == []:
-                    try:
-                        lines = next(generators[node.block_id][1])
-                        lines_buffer[node.block_id].extend(lines)
-                    except StopIteration:
-                        pass
-
-                # repopulate heap
-                if lines_buffer[node.block_id] != []:
-                    line = lines_buffer[node.block_id].pop(0)
-                    term, posting_list = self.load_line(line)
-                    heapq.heappush(heap, Node(
-                        term, posting_list, node.block_id))
+    def min_k_merge_generator(self, files: List[str], low: str = None, high: str = None) -> Generator[Tuple[str, PostingList], None, None]:
+        """
+        Provide an abstraction to get the minimum term of a set of files. The abstraction choosen was the generator abstraction. The sorting proccess is fast because already done comparisons dont go to waste as it forms a tree data structure
+
+        :param files: list of files from which to get the values
+        :param low: first term to merge, from the first term of the files when None
+        :param high: term at which the merge stops, until the last term of the files when None
+        :return: a tuple with the mininum valued term and its posting lists as it comes in the files
+        """
+        decode_entry = self.decode_entry
+        for term, entries in self.merge_entries(files, low, high):
+            if len(entries) == 1:
+                yield term, decode_entry(entries[0])
+            else:
+                # merge posting lists from different blocks and yield the result
+                yield term, self.ranker.merge_posting_lists(self.posting_list_class, [decode_entry(entry) for entry in entries])
 
     def _merge_blocks(self, input_paths: List[str], output_path: str):
         """
@@ -216,32 +402,131 @@ class Spimi():
         :param output_path: the file to which write the final big index
         :return: dictionary with all the terms inserted in the final index
         """
-        min_term_generator = self.min_k_merge_generator(input_paths)
+        boundaries = self.range_boundaries(self.merge_processes) if self.merge_processes > 1 else []
+        if len(boundaries) == 0:
+            entries = self._merge_range(input_paths, output_path)
+        else:
+            entries = self._merge_ranges(input_paths, output_path, boundaries)
+
+        self._write_dictionary(output_path, entries)
+
+        # return InvertedIndex(index, self.posting_type, output_path)
+
+    def _merge_range(self, input_paths: List[str], output_path: str, low: str = None, high: str = None) -> DictionaryEntries:
+        """
+        Merge the terms of the blocks from low (inclusive) to high (exclusive) and append them to the output file
+
+        :param input_paths: blocks or runs to merge
+        :param output_path: file to which append the posting lists
+        :param low: first term of the range, from the first term of the blocks when None
+        :param high: term that ends the range, until the last term of the blocks when None
+        :return: entries of the merged terms for the dictionary, with the offsets inside the output file
+        """
+        min_term_generator = self.min_k_merge_generator(input_paths, low, high)
         # index: Dict[str, None] = dict()
 
-        tiny_file = open(Path(f"{output_path}.tiny").resolve(), 'w')
-        with open(Path(output_path).resolve(), 'a') as output_file:
+        # entries of the dictionary loaded by the searcher, it has the offsets of the lexicon and the tiny representations
+        terms, term_starts = bytearray(), array('Q', [0])
+        tinies, tiny_starts = bytearray(), array('Q', [0])
+        offsets, lengths, document_frequencies = array('Q'), array('I'), array('I')
+        buffer_size = max(self.merge_buffer_bytes // (len(input_paths) + 1), io.DEFAULT_BUFFER_SIZE)
+        with open(Path(output_path).resolve(), 'ab', buffering=buffer_size) as output_file:
+            offset = output_file.seek(0, os.SEEK_END)
+
             # get mininum terms and their respective posting list
             for term, posting_list in min_term_generator:
                 # ranker calculations with the whole posting list
                 self.ranker.merge_calculations(posting_list)
                
                 # write to output file and get index
-                output_file.write(f"{term} {self.ranker.term_repr(posting_list)}\n")
+                term_bytes = f"{term} ".encode('utf-8')
+                if self.skip_block_size > 0:
+                    posting_list_bytes = self.ranker.term_skip_bytes(posting_list, self.skip_block_size)
+                elif self.compress:
+                    posting_list_bytes = self.ranker.term_bytes(posting_list)
+                else:
+                    posting_list_bytes = self.ranker.term_repr(posting_list).encode('utf-8')
+                output_file.write(term_bytes)
+                output_file.write(posting_list_bytes)
+                output_file.write(b'\n')
                 # index[term] = None
 
+                # save where the posting list starts, its length and the document frequency
+                offset += len(term_bytes)
+                terms += term_bytes[:-1]
+                term_starts.append(len(terms))
+                offsets.append(offset)
+                lengths.append(len(posting_list_bytes))
+                document_frequencies.append(len(posting_list))
+                offset += len(posting_list_bytes) + 1
+
                 # handle with tiny representation
                 tiny_repr = self.ranker.tiny_repr(posting_list)
                 if tiny_repr != None:
-                    tiny_file.write(f'{term} {tiny_repr}\n')
+                    tinies += tiny_repr.encode('utf-8')
+                tiny_starts.append(len(tinies))
 
-        # remove tiny when not used
-        if tiny_file.tell() == 0:
-            os.remove(tiny_file.name)
-        else:
-            tiny_file.close()
+        return bytes(terms), term_starts, bytes(tinies), tiny_starts, offsets, lengths, document_frequencies
 
-        # return InvertedIndex(index, self.posting_type, output_path)
+    def _merge_ranges(self, input_paths: List[str], output_path: str, boundaries: List[str]) -> DictionaryEntries:
+        """
+        Merge each range of terms in a different process to a part file, the parts are appended to the output file in the order of the ranges as soon as they are done
+
+        :param input_paths: blocks or runs to merge
+        :param output_path: the file to which write the final big index
+        :param boundaries: sorted terms that split the ranges
+        :return: entries of all the terms for the dictionary, with the offsets inside the output file
+        """
+        ranges = list(zip([None] + boundaries, boundaries + [None]))
+        part_paths = [f"{output_path}.part{i}" for i in range(len(ranges))]
+        terms, term_starts = bytearray(), array('Q', [0])
+        tinies, tiny_starts = bytearray(), array('Q', [0])
+        offsets, lengths, document_frequencies = array('Q'), array('I'), array('I')
+        # the indexer and its ranker state are sent once to each process instead of with every range
+        with ProcessPoolExecutor(self.merge_processes, initializer=init_merge_worker, initargs=(self,)) as executor, \
+                open(Path(output_path).resolve(), 'ab') as output_file:
+            futures = [executor.submit(merge_range, input_paths, part_path, low, high) for part_path, (low, high) in zip(part_paths, ranges)]
+            for part_path, future in zip(part_paths, futures):
+                part_terms, part_term_starts, part_tinies, part_tiny_starts, part_offsets, part_lengths, part_document_frequencies = future.result()
+
+                # the offsets of the part start where the output file ends
+                base = output_file.seek(0, os.SEEK_END)
+                with open(part_path, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file, self.merge_buffer_bytes)
+                os.remove(part_path)
+
+                term_starts.extend(start + len(terms) for start in part_term_starts[1:])
+                tiny_starts.extend(start + len(tinies) for start in part_tiny_starts[1:])
+                terms += part_terms
+                tinies += part_tinies
+                offsets.extend(offset + base for offset in part_offsets)
+                lengths.extend(part_lengths)
+                document_frequencies.extend(part_document_frequencies)
+
+        return bytes(terms), term_starts, bytes(tinies), tiny_starts, offsets, lengths, document_frequencies
+
+    def _write_dictionary(self, output_path: str, entries: DictionaryEntries) -> None:
+        """
+        Write the dictionary of the final index, it replaces the lexicon and the tiny files that are only read for the indexes written without it
+
+        :param output_path: the file of the final index
+        :param entries: entries of every term of the index, in the order of the terms
+        :return: None
+        """
+        terms, term_starts, tinies, tiny_starts, offsets, lengths, document_frequencies = entries
+        TermDictionary.write(f"{output_path}.dictionary", terms, term_starts, tinies, tiny_starts, offsets, lengths, document_frequencies)
+
+    def range_boundaries(self, ranges: int) -> List[str]:
+        """
+        Terms that split the terms of the blocks in ranges of about the same number of terms, taken from the samples kept when the blocks were written
+
+        :param ranges: number of ranges
+        :return: sorted terms that start every range but the first, less than ranges - 1 when there are not enough samples
+        """
+        samples = sorted(set(self.term_samples))
+        if len(samples) == 0:
+            return []
+        return sorted({samples[len(samples) * i // ranges] for i in range(1, ranges)} - {samples[0]})
 
     def construct_index(self, ouput_path: str = 'output.index'):
         """
@@ -251,42 +536,112 @@ class Spimi():
         :return: dictionary with only the terms as keys and None as values because the management of the index is done by the InvertedIndex class
         """
         # add last block
-        if self._inverted_index_size > 0:
-            self._write_block_to_disk(
-                f"{self.AUXILIARY_DIR}/{self.block_number}.{self.BLOCK_SUFFIX}")
+        self.flush_block()
 
         # save metadata
         self.inverted_index.save_data(Path(ouput_path).resolve(), self.metadata)
 
-        # get all files from the postings directory
-        block_paths = Path(self.AUXILIARY_DIR).rglob(f"*{self.BLOCK_SUFFIX}")
-        input_paths = [Path(file).resolve() for file in block_paths]
+        if self.background_merge:
+            # the blocks and runs left by the background merge
+            input_paths = self.merge_runs(self.wait_background_merges())
+        else:
+            # get all files from the postings directory in the order they were written
+            block_paths = sorted(Path(self.AUXILIARY_DIR).rglob(f"*{self.BLOCK_SUFFIX}"), key=Spimi.block_order)
+            input_paths = self.merge_runs([Path(file).resolve() for file in block_paths])
+            self.merge_levels = [[]]
 
         # merge those blocks into one file
         index = self._merge_blocks(input_paths, ouput_path)
+        self.remove_runs(input_paths)
 
         # save pos-processing
-        self.inverted_index.save_data(Path(ouput_path).resolve(), self.ranker.pos_processing())
+        self.inverted_index.save_data(Path(ouput_path).resolve(), self.ranker.pos_processing(ouput_path))
 
         return index
 
+    def merge_runs(self, input_paths: List[Path]) -> List[Path]:
+        """
+        Merge the blocks in passes of at most merge_fan_in blocks, like an external sort, until they can be merged at once into the final index.
+        Each group has consecutive blocks, so the merged runs keep the order of the documents, and it is written to a run in the auxiliary directory
+
+        :param input_paths: blocks in the order they were written
+        :return: blocks or runs left for the final merge, in the same order
+        """
+        merge_pass = 0
+        while self.merge_fan_in > 1 and len(input_paths) > self.merge_fan_in:
+            output_paths = []
+            for start in range(0, len(input_paths), self.merge_fan_in):
+                group = input_paths[start:start + self.merge_fan_in]
+                if len(group) == 1:
+                    output_paths.append(group[0])
+                    continue
+                run_path = Path(f"{self.AUXILIARY_DIR}/{merge_pass}_{start}.{self.RUN_SUFFIX}").resolve()
+                self._write_run(group, run_path)
+                output_paths.append(run_path)
+            # the runs of the previous pass are not needed anymore, the blocks are removed by clear_blocks()
+            self.remove_runs([path for path in input_paths if path not in output_paths])
+            input_paths = output_paths
+            merge_pass += 1
+        return input_paths
+
+    def _write_run(self, input_paths: List[Path], output_path: Path) -> None:
+        """
+        Merge blocks into a run, which has the same format of the blocks but without the ranker calculations of the final index
+
+        :param input_paths: blocks or runs to merge
+        :param output_path: file of the run
+        :return: None
+        """
+        buffer_size = max(self.merge_buffer_bytes // (len(input_paths) + 1), io.DEFAULT_BUFFER_SIZE)
+        if self.block_format == BlockFormat.BINARY:
+            encode, write_records = self.ranker.document_block, self.inverted_index.write_page_records
+        else:
+            encode, write_records = self.ranker.document_repr, self.inverted_index.write_line_records
+
+        def records() -> Generator[Tuple[str, object], None, None]:
+            # the terms of a single file are copied without decoding their posting lists
+            for term, entries in self.merge_entries(input_paths):
+                if len(entries) == 1:
+                    yield term, entries[0]
+                else:
+                    yield term, encode(self.ranker.merge_posting_lists(self.posting_list_class, [self.decode_entry(entry) for entry in entries]))
+        write_records(output_path, records(), buffer_size)
+
+    def remove_runs(self, paths: List[Path]) -> None:
+        for path in paths:
+            if Path(path).suffix == f'.{self.RUN_SUFFIX}':
+                os.remove(path)
+
     def clear_blocks(self):
-        for f in glob.glob(f'cache/blocks/*.block'):
+        for f in glob.glob(f'{self.AUXILIARY_DIR}/*.{self.BLOCK_SUFFIX}') + glob.glob(f'{self.AUXILIARY_DIR}/*.{self.RUN_SUFFIX}'):
             os.remove(f)
 
+    @staticmethod
+    def block_order(block_path: Path) -> Tuple[int]:
+        """
+        Key to sort the blocks by the order in which their documents were added, block names are numbers separated by "_"
+
+        :param block_path: path of the block
+        :return: tuple of the numbers in the block name
+        """
+        return tuple(int(part) for part in Path(block_path).stem.split('_'))
+
+
+# Spimi of the background merge process, sent once when the process starts
+merge_worker: Spimi = None
+
+
+def init_merge_worker(spimi: Spimi) -> None:
+    global merge_worker
+    merge_worker = spimi
+
 
-class Node:
-    """
-    Node of the heap used in the min_k_merge_generator() to sort the values with O(logN) complexity
-    """
-    term: str
-    posting_list: PostingList
-    block_id: int
+def merge_range(input_paths: List[str], output_path: str, low: str, high: str) -> DictionaryEntries:
+    return merge_worker._merge_range(input_paths, output_path, low, high)
 
-    def __init__(self, term: str, posting_list: PostingList, block_id: int):
-        self.term = term
-        self.posting_list = posting_list
-        self.block_id = block_id
 
-    def __lt__(self, other):
-        return self.term < other.term
+def write_background_run(input_paths: List[Path], output_path: Path) -> None:
+    # the blocks and runs merged are not needed anymore
+    merge_worker._write_run(input_paths, output_path)
+    for path in input_paths:
+        os.remove(path)
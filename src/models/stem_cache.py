@@ -0,0 +1,126 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from collections import OrderedDict
+import threading
+from typing import Callable, Dict, Iterable, List
+
+
+class StemCache:
+    """
+    Stems of the last tokens seen by the tokenizer, the least recently used are evicted when there are more than capacity
+    """
+    stemmer: Callable[[str], str]
+    capacity: int
+    # token and its stem, from the least to the most recently used
+    entries: OrderedDict
+    hits: int
+    misses: int
+    evictions: int
+    # the searches of the server share the tokenizer
+    lock: threading.Lock
+
+    def __init__(self, stemmer: Callable[[str], str], capacity: int = None) -> None:
+        """
+        :param stemmer: function that stems a token
+        :param capacity: number of stems kept, without limit when None
+        """
+        self.stemmer = stemmer
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def stem_tokens(self, tokens: Iterable[str]) -> List[str]:
+        """
+        Stem the tokens, using the cached stems when there are.
+        The lock is only held to read and update the cache, the missing tokens are stemmed without it so the other threads are not blocked,
+        two threads can then stem the same token and one stem replaces the other
+
+        :param tokens: tokens to stem
+        :return: stem of each token
+        """
+        tokens = list(tokens)
+        stems = [None] * len(tokens)
+        missing = []
+        with self.lock:
+            entries = self.entries
+            for i, token in enumerate(tokens):
+                stem = entries.get(token)
+                if stem == None:
+                    missing.append(i)
+                else:
+                    entries.move_to_end(token)
+                    stems[i] = stem
+            self.hits += len(tokens) - len(missing)
+
+        if len(missing) == 0: return stems
+
+        # the tokens repeated in the same call are stemmed once
+        new_stems = dict()
+        for i in missing:
+            token = tokens[i]
+            stem = new_stems.get(token)
+            if stem == None:
+                stem = self.stemmer(token)
+                new_stems[token] = stem
+            stems[i] = stem
+
+        with self.lock:
+            entries = self.entries
+            capacity = self.capacity
+            self.misses += len(new_stems)
+            self.hits += len(missing) - len(new_stems)
+            for token, stem in new_stems.items():
+                entries[token] = stem
+                entries.move_to_end(token)
+            while capacity != None and len(entries) > capacity:
+                entries.popitem(last=False)
+                self.evictions += 1
+        return stems
+
+    def warm(self, tokens: Iterable[str]) -> int:
+        """
+        Stem the tokens ahead of time, like the vocabulary of an index, until the cache is full
+
+        :param tokens: tokens to stem
+        :return: number of stems added
+        """
+        added = 0
+        for token in tokens:
+            with self.lock:
+                if self.capacity != None and len(self.entries) >= self.capacity: break
+                if token in self.entries: continue
+            stem = self.stemmer(token)
+            with self.lock:
+                if self.capacity != None and len(self.entries) >= self.capacity: break
+                if token in self.entries: continue
+                self.entries[token] = stem
+            added += 1
+        return added
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, object]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hit_ratio(), 3)
+            }
@@ -0,0 +1,154 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from __future__ import annotations
+from array import array
+import mmap
+import struct
+from typing import Callable, Iterator, Tuple
+import numpy as np
+
+
+class TermDictionary:
+    """
+    Lexicon and tiny representations of the terms written when merging the blocks, so the searcher starts without reading every term.
+    The terms are kept sorted in a single block of bytes with the start of each one in an array, the same for the tiny representations,
+    followed by the offset, length and document frequency of each posting list. The file is memory mapped and the terms are found by binary search.
+    """
+    # magic, number of terms, bytes of the terms and bytes of the tiny representations
+    header_struct: struct.Struct = struct.Struct('<4sIQQ')
+    magic: bytes = b'TDIC'
+
+    file_map: mmap.mmap
+    size: int
+    term_starts: np.ndarray
+    tiny_starts: np.ndarray
+    offsets: np.ndarray
+    lengths: np.ndarray
+    document_frequencies: np.ndarray
+    terms_start: int
+    tinies_start: int
+
+    def __init__(self, file_name: str) -> None:
+        with open(file_name, 'rb') as file:
+            self.file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, terms_length, _ = TermDictionary.header_struct.unpack_from(self.file_map)
+        if magic != TermDictionary.magic:
+            raise Exception(f'"{file_name}" is not a term dictionary')
+
+        position = TermDictionary.header_struct.size
+        def read_array(dtype: str, count: int) -> np.ndarray:
+            nonlocal position
+            values = np.frombuffer(self.file_map, dtype=dtype, count=count, offset=position)
+            position += values.nbytes
+            return values
+        self.term_starts = read_array('<u8', self.size + 1)
+        self.tiny_starts = read_array('<u8', self.size + 1)
+        self.offsets = read_array('<u8', self.size)
+        self.lengths = read_array('<u4', self.size)
+        self.document_frequencies = read_array('<u4', self.size)
+        self.terms_start = position
+        self.tinies_start = position + terms_length
+
+    def close(self) -> None:
+        # the arrays are read in place from the map, they are dropped before it is closed
+        self.term_starts = self.tiny_starts = self.offsets = self.lengths = self.document_frequencies = None
+        self.file_map.close()
+
+    @staticmethod
+    def write(file_name: str, terms: bytes, term_starts: array, tinies: bytes, tiny_starts: array, offsets: array, lengths: array, document_frequencies: array) -> None:
+        """
+        Write the snapshot, the arrays have one entry per term in sorted order and the starts have one more with the end of the last term
+
+        :param file_name: dictionary file
+        :param terms: terms encoded in utf-8 one after the other
+        :param term_starts: start of each term inside terms
+        :param tinies: tiny representations encoded in utf-8 one after the other
+        :param tiny_starts: start of each tiny representation inside tinies
+        :param offsets: start of each posting list inside the index file
+        :param lengths: length in bytes of each posting list
+        :param document_frequencies: number of documents of each posting list
+        :return: None
+        """
+        with open(file_name, 'wb') as file:
+            file.write(TermDictionary.header_struct.pack(TermDictionary.magic, len(offsets), len(terms), len(tinies)))
+            # the 64 bit arrays go first so every array stays aligned
+            for values, dtype in ((term_starts, '<u8'), (tiny_starts, '<u8'), (offsets, '<u8'), (lengths, '<u4'), (document_frequencies, '<u4')):
+                file.write(np.asarray(values, dtype=dtype).tobytes())
+            file.write(terms)
+            file.write(tinies)
+
+    def term(self, i: int) -> bytes:
+        return self.file_map[self.terms_start + int(self.term_starts[i]):self.terms_start + int(self.term_starts[i+1])]
+
+    def find(self, term: str) -> int:
+        """
+        Binary search of a term, the terms are sorted by their code points which is the order of their utf-8 bytes
+
+        :param term: term to find
+        :return: position of the term or -1 when it is not in the dictionary
+        """
+        key = term.encode('utf-8')
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            middle_term = self.term(middle)
+            if middle_term < key:
+                low = middle + 1
+            elif middle_term > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def __contains__(self, term: str) -> bool:
+        return self.find(term) != -1
+
+    def __getitem__(self, term: str) -> Tuple[int, int, int]:
+        i = self.find(term)
+        if i == -1: raise KeyError(term)
+        return self.entry(i)
+
+    def entry(self, i: int) -> Tuple[int, int, int]:
+        return (int(self.offsets[i]), int(self.lengths[i]), int(self.document_frequencies[i]))
+
+    def last(self) -> Tuple[int, int, int]:
+        # the posting lists are written in the order of the terms, the last one ends the index
+        return self.entry(self.size - 1)
+
+    def tiny(self, term: str) -> str:
+        i = self.find(term)
+        if i == -1: return None
+        start, end = self.tinies_start + int(self.tiny_starts[i]), self.tinies_start + int(self.tiny_starts[i+1])
+        if start == end: return None
+        return self.file_map[start:end].decode('utf-8')
+
+    def tiny_dictionary(self, load_tiny: Callable[[str], object]) -> TinyDictionary:
+        return TinyDictionary(self, load_tiny)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.size):
+            yield self.term(i).decode('utf-8')
+
+
+class TinyDictionary:
+    """
+    Tiny representations of a term dictionary, each one is parsed by the ranker when its term is searched
+    """
+    dictionary: TermDictionary
+    load_tiny: Callable[[str], object]
+
+    def __init__(self, dictionary: TermDictionary, load_tiny: Callable[[str], object]) -> None:
+        self.dictionary = dictionary
+        self.load_tiny = load_tiny
+
+    def get(self, term: str, default: object = None) -> object:
+        tiny = self.dictionary.tiny(term)
+        return self.load_tiny(tiny) if tiny != None else default
+
+    def __contains__(self, term: str) -> bool:
+        return self.dictionary.tiny(term) != None
@@ -3,8 +3,9 @@
 # Vasco Sousa  - 93049
 
 from pathlib import Path
-from typing import Dict, Set
+from typing import Dict, Iterable, Set
 from nltk.stem.snowball import SnowballStemmer
+from models.stem_cache import StemCache
 from string import punctuation
 import re
 
@@ -13,24 +14,33 @@ class Tokenizer:
     min_token_length: int or None
     snow_stemmer: SnowballStemmer or None
     stop_words: Set[str] or None
-    transforms: Dict[str, str]
+    stem_cache: StemCache or None
+    # every punctuation character is replaced by a space with a single str.translate
+    punctuation_table: Dict[int, str] = str.maketrans(punctuation, ' ' * len(punctuation))
+    # the words, and the tabs and new lines as tokens of their own
+    token_pattern: re.Pattern = re.compile(r'\S+|\t|\n')
 
     def __init__(self,
                  min_token_length: int = None,
                  stop_words_path: str = None,
-                 stem_lang: str = None) -> None:
+                 stem_lang: str = None,
+                 stem_cache_size: int = 100000) -> None:
         """
         __init__ creates a new instance of Tokenizer
 
         :param min_token_length: min length of accepted tokens
         :param stop_words_path: path to the file of stop words
         :param stem_lang: language of the tokens
+        :param stem_cache_size: number of stems kept to avoid stemming the same tokens again, without limit when None
         :return: None
         """
-        self.transforms = dict()
         self.min_token_length = min_token_length
+        if min_token_length != None and min_token_length > 1:
+            # the tabs and new lines are shorter than the minimum, so only the words long enough are matched
+            self.token_pattern = re.compile(r'\S{%d,}' % min_token_length)
         self.snow_stemmer = SnowballStemmer(
             language=stem_lang) if stem_lang != None else None
+        self.stem_cache = StemCache(self.snow_stemmer.stem, stem_cache_size) if self.snow_stemmer != None else None
 
         if stop_words_path != None:
             with open(Path(stop_words_path)) as file:
@@ -46,27 +56,28 @@ class Tokenizer:
         :return: None
         """
 
-        no_ponctuation = map(lambda w: " " if w in punctuation else w, text)
-        lowered = "".join(no_ponctuation).lower()
-        tokens = list(re.findall(r'\S+|\t|\n', lowered))
+        lowered = text.translate(Tokenizer.punctuation_table).lower()
+        tokens = self.token_pattern.findall(lowered)
 
-        if self.min_token_length != None:
-            tokens = filter(lambda n: len(n) >= self.min_token_length, tokens)
+        if self.min_token_length != None and self.token_pattern is Tokenizer.token_pattern:
+            min_token_length = self.min_token_length
+            tokens = [token for token in tokens if len(token) >= min_token_length]
 
         if self.stop_words != None:
-            tokens = filter(lambda n: n not in self.stop_words, tokens)
+            stop_words = self.stop_words
+            tokens = [token for token in tokens if token not in stop_words]
 
-        if self.snow_stemmer != None:
-            aux = []
+        if self.stem_cache != None:
+            tokens = self.stem_cache.stem_tokens(tokens)
 
-            for token in tokens:
-                transform = self.transforms.get(token)
+        return tokens
 
-                if transform == None:
-                    transform = self.snow_stemmer.stem(token)
-                    self.transforms[token] = transform
-                aux.append(transform)
-
-            tokens = aux
+    def warm_stem_cache(self, tokens: Iterable[str]) -> int:
+        """
+        warm_stem_cache stems the given tokens ahead of time, like the vocabulary of an index, until the stem cache is full
 
-        return list(tokens)
+        :param tokens: tokens to stem
+        :return: number of stems added to the cache
+        """
+        if self.stem_cache == None: return 0
+        return self.stem_cache.warm(tokens)
@@ -3,12 +3,17 @@
 # Vasco Sousa  - 93049
 
 from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 import time
-from typing import List
+import sys
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
 from efficiency import Efficiency
 from models.index import InvertedIndex
 from models.posting_list import PostingType
 from models.ranker import Ranker, RankerFactory, RankingMethod
+from models.search_executor import SearchExecutor
 from models.tokenizer import Tokenizer
 
 def parse_args():
@@ -34,6 +39,108 @@ def parse_args():
         required=False,
         default=10
     )
+    arg_parser.add_argument(
+        "--mmap",
+        action="store_true",
+        dest="use_mmap",
+        help="Memory map the index files once instead of opening them on every search",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--dynamic-pruning",
+        action="store_true",
+        dest="dynamic_pruning",
+        help="Skip the documents that can not reach the top n with the MaxScore algorithm, only for the BM25 ranker",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--cache-bytes",
+        type=int,
+        dest="cache_bytes",
+        help="Memory budget in bytes of the posting lists kept between searches, the least recently used are evicted first",
+        required=False,
+        default=256 * 1024 * 1024
+    )
+    arg_parser.add_argument(
+        "--query-cache-size",
+        type=int,
+        dest="query_cache_size",
+        help="Number of search results kept for the repeated queries, 0 disables the cache",
+        required=False,
+        default=1024
+    )
+    arg_parser.add_argument(
+        "--query-cache-ttl",
+        type=float,
+        dest="query_cache_ttl",
+        help="Seconds the cached search results are valid",
+        required=False,
+        default=300
+    )
+    arg_parser.add_argument(
+        "--warm-stem-cache",
+        action="store_true",
+        dest="warm_stem_cache",
+        help="Stem the terms of the index at startup, until the stem cache of the tokenizer is full",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--queries-file",
+        dest="queries_file",
+        help="File with one query per line, or one JSON object with a query field per line, searched in batches",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--results-file",
+        dest="results_file",
+        help="JSON lines file with the results of the queries file, the standard output by default",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        help="Number of queries of the queries file searched together, their posting lists are read once",
+        required=False,
+        default=1000
+    )
+    arg_parser.add_argument(
+        "--processes",
+        type=int,
+        dest="processes",
+        help="Search the queries file in this number of worker processes, each one opens the index",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--serve",
+        action="store_true",
+        dest="serve",
+        help="Answer the searches over HTTP with JSON instead of the interactive search",
+        required=False
+    )
+    arg_parser.add_argument(
+        "--host",
+        dest="host",
+        help="Address of the search server",
+        required=False,
+        default="127.0.0.1"
+    )
+    arg_parser.add_argument(
+        "--port",
+        type=int,
+        dest="port",
+        help="Port of the search server",
+        required=False,
+        default=8000
+    )
+    arg_parser.add_argument(
+        "--workers",
+        type=int,
+        dest="workers",
+        help="Number of worker processes that rank the searches of the search server, the number of CPUs by default",
+        required=False,
+        default=None
+    )
 
     return arg_parser.parse_args()
 
@@ -50,7 +157,7 @@ def search(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, search_terms
         matches = [(int(doc_id), float(score)) for doc_id, score in results]
 
         # convert the auxiliary doc id into real ones
-        doc_id_to_real_doc_id = index.fetch_terms([doc_id for doc_id, _ in matches], index.metadata['doc_mapping'])
+        doc_id_to_real_doc_id = index.fetch_doc_ids([doc_id for doc_id, _ in matches])
 
         t2 = time.perf_counter()
         if verbose: print(f"Search in {(t2-t1)* 100}ms")
@@ -58,19 +165,191 @@ def search(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, search_terms
         return [(doc_id_to_real_doc_id[match], score) for match, score in matches]
 
 
+def search_batch(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, queries:List[str], n_results:int, executor:SearchExecutor=None) -> List[List[Tuple[str, float]]]:
+        """
+        Search many queries reading the posting list of each term once, the real doc ids of all the results are also read together
+
+        :param queries: text of each query
+        :param executor: worker processes that search the queries, they are searched in this process when None
+        :return: real doc id and score of the results of each query
+        """
+        if executor != None:
+            # the workers read the real doc ids from the index that ranked the queries
+            return executor.search(queries, n_results)
+
+        results = index.search_batch([tokenizer.tokenize(query) for query in queries], n_results, ranker, show_score=True)
+        results = [[(int(doc_id), float(score)) for doc_id, score in query_results] for query_results in results]
+
+        # convert the auxiliary doc ids into real ones, in increasing order
+        doc_ids = sorted(set(doc_id for query_results in results for doc_id, _ in query_results))
+        doc_id_to_real_doc_id = index.fetch_doc_ids(doc_ids)
+
+        return [[(doc_id_to_real_doc_id[doc_id], score) for doc_id, score in query_results] for query_results in results]
+
+
+def read_queries(file_name:str) -> List[Dict[str, object]]:
+    """
+    Read a queries file, the lines can have only the query or be JSON objects with a query field and other fields that are copied to the results
+
+    :param file_name: queries file
+    :return: JSON object of each query
+    """
+    queries = []
+    with open(file_name, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line == '': continue
+            if line.startswith('{'):
+                queries.append(json.loads(line))
+            else:
+                queries.append({'query': line})
+    return queries
+
+
+def search_queries_file(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, queries_file:str, results_file:str, n_results:int, batch_size:int, executor:SearchExecutor=None):
+    queries = read_queries(queries_file)
+    output = open(results_file, 'w', encoding='utf-8') if results_file != None else sys.stdout
+    try:
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            results = search_batch(index, ranker, tokenizer, [str(query['query']) for query in batch], n_results, executor)
+            for query, query_results in zip(batch, results):
+                line = dict(query)
+                line['results'] = [{'doc_id': doc_id, 'score': score} for doc_id, score in query_results]
+                output.write(json.dumps(line) + '\n')
+    finally:
+        if output is not sys.stdout: output.close()
+
+
+def search_cached(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, query:str, n_results:int, executor:SearchExecutor) -> List[Tuple[str, float]]:
+    """
+    Search a query in the query cache of the index, or rank it in one of the worker processes and cache its results
+
+    :param index: loaded index, only its query cache is used
+    :param query: text of the query
+    :param executor: worker processes that rank the query
+    :return: real doc id and score of the results
+    """
+    tokens = tokenizer.tokenize(query)
+    key = index.query_key(tokens, n_results, ranker)
+    results = index.query_cache.get(key)
+    if results == None:
+        # the ranking is bound by the CPU, in other processes the searches are not serialized by the GIL
+        version, results = executor.search_tokens(tokens, n_results)
+        # the workers and this process reload the index on their own, the results are only cached when they were ranked with the index this process has loaded
+        index.query_cache.put(key, results, version)
+    return results
+
+
+def serve(index:InvertedIndex, ranker:Ranker, tokenizer:Tokenizer, n_results:int, host:str, port:int, executor:SearchExecutor):
+    """
+    Answer the searches over HTTP, each connection has its own thread that tokenizes the query and looks it up in the query cache, the searches that are not cached are ranked by the worker processes.
+    GET /search?query=...&n=... or POST /search with a JSON body {"query": ..., "n": ...} returns the results as JSON, GET /stats returns the counters of the posting list caches of the workers and of the query and stem caches.
+
+    :param index: loaded index
+    :param ranker: ranker of the index
+    :param tokenizer: tokenizer of the index
+    :param n_results: number of results when the request does not have n
+    :param host: address of the server
+    :param port: port of the server
+    :param executor: worker processes that rank the searches, each one with its own posting list cache
+    :return: None
+    """
+    # load the ranker data before the first request so the handlers only read it
+    ranker.load_metadata(index.metadata)
+
+    class SearchRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                self.send_json(200, {
+                    'posting_list_cache': executor.stats(),
+                    'query_cache': index.query_cache.stats(),
+                    'stem_cache': tokenizer.stem_cache.stats() if tokenizer.stem_cache != None else None
+                })
+            elif url.path == '/search':
+                parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self.search(parameters)
+            else:
+                self.send_json(404, {'error': f'Unknown path {url.path}'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/search':
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+                return
+            try:
+                parameters = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self.send_json(400, {'error': 'The body must be a JSON object'})
+                return
+            self.search(parameters)
+
+        def search(self, parameters:dict):
+            if not isinstance(parameters, dict) or not isinstance(parameters.get('query'), str):
+                self.send_json(400, {'error': 'Missing query'})
+                return
+            try:
+                n = int(parameters.get('n', n_results))
+            except ValueError:
+                self.send_json(400, {'error': 'n must be an integer'})
+                return
+            start_time = time.perf_counter()
+            try:
+                results = search_cached(index, ranker, tokenizer, parameters['query'], n, executor)
+            except Exception as exception:
+                self.send_json(500, {'error': str(exception)})
+                return
+            self.send_json(200, {
+                'query': parameters['query'],
+                'results': [{'doc_id': doc_id, 'score': score} for doc_id, score in results],
+                'time_ms': round((time.perf_counter() - start_time) * 1000, 3)
+            })
+
+        def send_json(self, status:int, body:dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    print(f"Serving searches on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 if __name__ == '__main__':
     args = parse_args()
     verbose = False 
 
     t1 = time.perf_counter()
-    index = InvertedIndex(None, output_path=args.search_index)
-    ranker = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']))
+    index = InvertedIndex(None, output_path=args.search_index, use_mmap=args.use_mmap, cache_bytes=args.cache_bytes, query_cache_size=args.query_cache_size, query_cache_ttl=args.query_cache_ttl)
+    ranker = RankerFactory(RankingMethod(index.metadata['ranker']))(PostingType(index.metadata['posting_class']), dynamic_pruning=args.dynamic_pruning)
     tokenizer = Tokenizer(index.metadata['min_token_length'], index.metadata['stop_words'], index.metadata['language'])
+    if args.warm_stem_cache:
+        # most words of the queries that are in the index have the same stem as the term
+        tokenizer.warm_stem_cache(iter(index.lexicon) if len(index.lexicon) > 0 else iter(index.inverted_index))
     t2 = time.perf_counter()
-    if verbose: print(f"Time to start searcher {(t2-t1)* 100}ms")
+    print(f"Time to start searcher {round((t2-t1) * 1000, 3)} ms", file=sys.stderr)
 
     
-    if args.query == None:
+    if args.queries_file != None:
+        start_time = time.perf_counter()
+        if args.processes != None:
+            with SearchExecutor(args.search_index, args.processes, use_mmap=args.use_mmap, cache_bytes=args.cache_bytes, dynamic_pruning=args.dynamic_pruning) as executor:
+                search_queries_file(index, ranker, tokenizer, args.queries_file, args.results_file, args.n_results, args.batch_size, executor)
+        else:
+            search_queries_file(index, ranker, tokenizer, args.queries_file, args.results_file, args.n_results, args.batch_size)
+        print(f"Searched {args.queries_file} in {round(time.perf_counter() - start_time, 3)} s", file=sys.stderr)
+    elif args.serve:
+        with SearchExecutor(args.search_index, args.workers, use_mmap=args.use_mmap, cache_bytes=args.cache_bytes, dynamic_pruning=args.dynamic_pruning) as executor:
+            serve(index, ranker, tokenizer, args.n_results, args.host, args.port, executor)
+    elif args.query == None:
         while(True):
             query = input("Search (exit interactive search with 'q'): ").split(' ')
             if len(query) == 1 and query[0].lower() == 'q': break
@@ -82,6 +361,9 @@ if __name__ == '__main__':
             efficiency.calculate_stats(' '.join(query), results)
             print(results)
             print(efficiency)
+            print(f"Posting list cache: {index.posting_list_cache.stats()}")
+            print(f"Query cache: {index.query_cache.stats()}")
+            if tokenizer.stem_cache != None: print(f"Stem cache: {tokenizer.stem_cache.stats()}")
     else:
         efficiency = Efficiency()
         start_time = time.perf_counter()
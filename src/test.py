@@ -36,7 +36,7 @@ if __name__ == '__main__':
     # search_terms = "greatest rock album"
     texts = ['good games for kids', 'good old games games', 'haha lols are funny']
     search_terms = "good old games games"
-    max_ram = 95
+    max_block_bytes = 1024 * 1024
     max_block_size = 20
     posting_list_type = PostingType.FREQUENCY
     ranking_method = RankingMethod.TF_IDF
@@ -50,7 +50,7 @@ if __name__ == '__main__':
     print("------------ Indexing -------------")
     
     t1 = time.perf_counter()
-    indexer = Spimi(ranker=ranker, max_ram_usage=max_ram, max_block_size=max_block_size,
+    indexer = Spimi(ranker=ranker, max_block_bytes=max_block_bytes, max_block_size=max_block_size,
                     auxiliary_dir=BLOCK_DIR, posting_type=posting_list_type)
 
     indexer.extend_metadata({
@@ -0,0 +1,44 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+import pytest
+from models.posting_list import PostingType
+from models.ranker import RankerFactory, RankingMethod
+from models.doc_mapping import DocMappingWriter
+from models.spimi import Spimi
+
+
+@pytest.fixture
+def build_index():
+    def build_index(directory, documents, compress=False, skip_block_size=0, doc_ids=None) -> str:
+        """
+        Index the documents with the BM25 ranker
+
+        :param directory: directory of the blocks and of the index
+        :param documents: tokens of each document, the doc ids are their positions
+        :param compress: write the posting lists with variable byte encoding
+        :param skip_block_size: documents of each block of the posting lists with skip entries, 0 to disable
+        :param doc_ids: real doc id of each document, D0, D1, ... when None
+        :return: path of the index file
+        """
+        (directory / 'blocks').mkdir(exist_ok=True)
+        output_path = str(directory / 'test.index')
+        ranker = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY, k=1.2, b=0.75)
+        indexer = Spimi(ranker=ranker, max_block_size=100, auxiliary_dir=str(directory / 'blocks'), compress=compress, skip_block_size=skip_block_size)
+        indexer.extend_metadata({
+            'posting_class': PostingType.FREQUENCY.value,
+            'min_token_length': None,
+            'stop_words': None,
+            'language': None,
+            'doc_mapping': str(directory / 'docs_mapping.bin')
+        })
+        with DocMappingWriter(str(directory / 'docs_mapping.bin')) as doc_mapping:
+            for doc_id, tokens in enumerate(documents):
+                indexer.add_document(doc_id=doc_id, tokens=tokens)
+                doc_mapping.add(doc_ids[doc_id] if doc_ids != None else f'D{doc_id}')
+        indexer.construct_index(output_path)
+        indexer.clear_blocks()
+        return output_path
+
+    return build_index
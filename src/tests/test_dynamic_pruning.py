@@ -0,0 +1,53 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+import random
+import pytest
+from models.index import InvertedIndex
+from models.posting_list import PostingType
+from models.ranker import RankerFactory, RankingMethod
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    generator = random.Random(0)
+    words = [f'w{i}' for i in range(300)]
+    # few words with a Zipf distribution and short documents, so many documents get the same score
+    cumulative_weights = []
+    total = 0
+    for rank in range(1, len(words) + 1):
+        total += 1 / rank
+        cumulative_weights.append(total)
+    documents = [generator.choices(words, cum_weights=cumulative_weights, k=generator.randint(1, 40)) for _ in range(3000)]
+    queries = [generator.choices(words, cum_weights=cumulative_weights, k=generator.randint(1, 6)) for _ in range(200)]
+    queries += [[word] for word in words[:20]] + [['w0', 'w1', 'w2', 'w3'], ['unknown'], ['w5', 'unknown']]
+    return documents, queries
+
+
+@pytest.mark.parametrize('compress, skip_block_size', [(False, 0), (True, 0), (True, 4), (True, 32)])
+def test_dynamic_pruning_returns_exhaustive_results(tmp_path, build_index, corpus, compress, skip_block_size):
+    documents, queries = corpus
+    index = InvertedIndex(None, output_path=build_index(tmp_path, documents, compress, skip_block_size))
+    exhaustive = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY)
+    pruning = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY, dynamic_pruning=True)
+
+    for query in queries:
+        for n in (1, 3, 10, 100):
+            expected = index.search(query, n, exhaustive, show_score=True)
+            assert index.search(query, n, pruning, show_score=True) == expected, (query, n)
+
+
+@pytest.mark.parametrize('compress, skip_block_size', [(False, 0), (True, 0), (True, 4)])
+def test_dynamic_pruning_keeps_ties_with_the_threshold(tmp_path, build_index, compress, skip_block_size):
+    # both terms have the same upper bound and every document the same score, the documents with the
+    # lowest doc ids are only found in the term visited last, in blocks whose bound equals the threshold
+    documents = [['b']] * 20 + [['a']] * 20 + [['c', 'd']] * 10
+    index = InvertedIndex(None, output_path=build_index(tmp_path, documents, compress, skip_block_size))
+    exhaustive = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY)
+    pruning = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY, dynamic_pruning=True)
+
+    for query in (['a', 'b'], ['b', 'a'], ['a', 'b', 'c']):
+        for n in (1, 5, 20, 30):
+            expected = index.search(query, n, exhaustive, show_score=True)
+            assert index.search(query, n, pruning, show_score=True) == expected, (query, n)
@@ -0,0 +1,57 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+import csv
+import gzip
+import random
+import shutil
+from pathlib import Path
+import pytest
+import indexer
+from models.posting_list import PostingType
+from models.ranker import RankingMethod
+from models.spimi import BlockFormat
+
+
+def write_documents(file_name, n_documents):
+    words = [f'word{i}' for i in range(150)]
+    generator = random.Random(0)
+    with gzip.open(file_name, 'wt', newline='') as file:
+        writer = csv.writer(file, delimiter='\t')
+        writer.writerow(['review_id', 'review_headline', 'review_body'])
+        for i in range(n_documents):
+            headline = ' '.join(generator.choices(words, k=generator.randint(1, 4)))
+            body = ' '.join(generator.choices(words, k=generator.randint(1, 30)))
+            writer.writerow([f'R{i}', headline, body])
+
+
+def build(documents, **options):
+    indexer.index(None, 0, None, [documents], PostingType.FREQUENCY, 40, 512 * 1024 * 1024, RankingMethod.BM25, 'lnc.ltc', 1.2, 0.75, chunk_size=30, **options)
+    files = {extension: Path(f'{indexer.OUTPUT_INDEX}{extension}').read_bytes() for extension in ('', '.dictionary', '.doclengths')}
+    shutil.rmtree('cache')
+    return files
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'block_format': BlockFormat.BINARY, 'compress': True},
+    {'merge_processes': 3},
+    {'background_merge': True, 'merge_fan_in': 2, 'merge_processes': 2}
+])
+def test_index_of_the_workers_is_the_serial_index(tmp_path, monkeypatch, options):
+    monkeypatch.chdir(tmp_path)
+    write_documents('documents.gz', 250)
+    # both indexes have the same paths, which are written to the metadata
+    monkeypatch.setattr(indexer, 'OUTPUT_INDEX', 'cache/index/test.index')
+    monkeypatch.setattr(indexer, 'DOC_MAPPING_FILE', 'cache/mappings/test.bin')
+
+    indexes = []
+    # the serial index is built by a single process with the default merge, only the encoding of the posting lists is the same
+    for run_options in ({'compress': options.get('compress', False)}, {'workers': 2, **options}):
+        for directory in ('blocks', 'index', 'mappings'):
+            (tmp_path / 'cache' / directory).mkdir(parents=True)
+        indexes.append(build('documents.gz', **run_options))
+
+    for extension in ('', '.dictionary', '.doclengths'):
+        assert indexes[1][extension] == indexes[0][extension], f'the {extension or ".index"} files differ'
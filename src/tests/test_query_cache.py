@@ -0,0 +1,79 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+import os
+import threading
+from models.index import InvertedIndex
+from models.posting_list import PostingType
+from models.query_cache import QueryCache
+from models.ranker import RankerFactory, RankingMethod
+
+
+def test_file_is_checked_once_every_interval(tmp_path):
+    file = tmp_path / 'test.index'
+    file.write_text('a')
+    changes = []
+    cache = QueryCache(10, files=[str(file)], check_interval=3600, on_change=changes.append)
+    cache.put('query', [1])
+
+    file.write_text('ab')
+    assert cache.get('query') == [1]
+    assert changes == []
+
+    cache.check_interval = 0
+    assert cache.get('query') == None
+    assert changes == [cache.files_version]
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_results_of_replaced_files_are_not_saved(tmp_path):
+    file = tmp_path / 'test.index'
+    file.write_text('a')
+    cache = QueryCache(10, files=[str(file)], check_interval=0)
+    version = cache.files_version
+
+    file.write_text('ab')
+    cache.get('other query')
+    cache.put('query', [1], version)
+    assert cache.get('query') == None
+    cache.put('query', [2], cache.files_version)
+    assert cache.get('query') == [2]
+
+
+def test_index_is_reloaded_when_it_changes(tmp_path, build_index):
+    output_path = build_index(tmp_path, [['a'], ['b'], ['a', 'b']], compress=True)
+    index = InvertedIndex(None, output_path=output_path, query_cache_size=10)
+    index.query_cache.check_interval = 0
+    ranker = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY)
+    assert sorted(index.search(['a'], 10, ranker)) == [0, 2]
+    assert sorted(index.search(['b'], 10, ranker)) == [1, 2]
+
+    # the posting list of a is cached while b is written again with new documents
+    build_index(tmp_path, [['b'], ['b'], ['a'], ['b', 'c']], compress=True)
+    # the rewritten files can keep the size and the modification time in coarse file systems
+    for file in (output_path, f'{output_path}.dictionary'):
+        os.utime(file, ns=(0, 0))
+    assert sorted(index.search(['a'], 10, ranker)) == [2]
+    assert sorted(index.search(['c'], 10, ranker)) == [3]
+    assert index.posting_list_cache.stats()['hits'] == 0
+
+
+def test_reload_waits_for_the_searches_and_closes_the_old_files(tmp_path, build_index):
+    output_path = build_index(tmp_path, [['a'], ['b']], compress=True)
+    index = InvertedIndex(None, output_path=output_path, use_mmap=True)
+    index_reader, maps = index.index_reader, dict(index.maps)
+
+    with index.lock.read():
+        reload = threading.Thread(target=index.reload, args=(index.query_cache.read_files_version(),))
+        reload.start()
+        reload.join(0.2)
+        assert reload.is_alive()
+        assert index.index_reader is index_reader
+    reload.join()
+
+    assert index.index_reader is not index_reader
+    assert index_reader.closed
+    assert all(file_map.closed for file_map in maps.values())
+    ranker = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY)
+    assert index.search(['b'], 10, ranker) == [1]
@@ -0,0 +1,49 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+import time
+from models.index import InvertedIndex
+from models.posting_list import PostingType
+from models.ranker import RankerFactory, RankingMethod
+from models.search_executor import SearchExecutor
+from models.tokenizer import Tokenizer
+from searcher import search_cached
+
+
+def test_results_of_an_index_rewritten_under_the_workers(tmp_path, build_index):
+    output_path = build_index(tmp_path, [['a'], ['b']], compress=True)
+    index = InvertedIndex(None, output_path=output_path, query_cache_size=10)
+    index.query_cache.check_interval = 0
+    ranker = RankerFactory(RankingMethod.BM25)(PostingType.FREQUENCY)
+    ranker.load_metadata(index.metadata)
+    tokenizer = Tokenizer()
+
+    with SearchExecutor(output_path, 1) as executor:
+        assert [doc_id for doc_id, _ in search_cached(index, ranker, tokenizer, 'a', 10, executor)] == ['D0']
+        assert executor.search(['a', 'b'], 10) == [search_cached(index, ranker, tokenizer, query, 10, executor) for query in ('a', 'b')]
+
+        build_index(tmp_path, [['b'], ['a'], ['c']], compress=True, doc_ids=['E0', 'E1', 'E2'])
+        # this process loads the new index at once while the worker can still rank with the old one for up to a second,
+        # its results come from the old lexicon and doc mapping and must not be cached
+        search_cached(index, ranker, tokenizer, 'a', 10, executor)
+
+        # the workers check the index files once a second
+        time.sleep(1.1)
+        assert [doc_id for doc_id, _ in search_cached(index, ranker, tokenizer, 'a', 10, executor)] == ['E1']
+        assert [doc_id for doc_id, _ in search_cached(index, ranker, tokenizer, 'a', 10, executor)] == ['E1']
+        assert [[doc_id for doc_id, _ in query_results] for query_results in executor.search(['a', 'c'], 10)] == [['E1'], ['E2']]
+
+
+def test_stats_of_the_worker_caches(tmp_path, build_index):
+    output_path = build_index(tmp_path, [['a'], ['b'], ['a', 'b']], compress=True)
+    with SearchExecutor(output_path, 2) as executor:
+        assert executor.stats() == {'total': {}, 'workers': {}}
+        executor.search_tokens(['a'], 10)
+        executor.search_tokens(['a'], 10)
+        executor.search(['a b', 'b'], 10)
+        stats = executor.stats()
+
+    assert 1 <= len(stats['workers']) <= 2
+    assert stats['total']['hits'] + stats['total']['misses'] == 5
+    assert stats['total']['hits'] == sum(worker_stats['hits'] for worker_stats in stats['workers'].values())
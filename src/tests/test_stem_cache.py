@@ -0,0 +1,27 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from models.stem_cache import StemCache
+
+
+def test_stemmer_runs_without_the_lock():
+    stemmed = []
+    def stemmer(token):
+        # another thread could look up its tokens meanwhile
+        assert not cache.lock.locked()
+        stemmed.append(token)
+        return token[:3]
+    cache = StemCache(stemmer, capacity=3)
+
+    assert cache.stem_tokens(['songs', 'singing', 'songs']) == ['son', 'sin', 'son']
+    assert cache.stem_tokens(['songs', 'games', 'gaming']) == ['son', 'gam', 'gam']
+    assert stemmed == ['songs', 'singing', 'games', 'gaming']
+    assert list(cache.entries) == ['songs', 'games', 'gaming']
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 4, 1)
+
+    assert cache.warm(['tests', 'songs']) == 0
+    cache.clear()
+    assert cache.warm(['tests', 'songs', 'tests', 'games', 'gaming']) == 3
+    assert list(cache.entries) == ['tests', 'songs', 'games']
@@ -0,0 +1,52 @@
+# Authors:
+# Tiago Rainho - 92984
+# Vasco Sousa  - 93049
+
+from pathlib import Path
+import random
+from string import punctuation
+import pytest
+from benchmark import reference_tokenize
+from models.tokenizer import Tokenizer
+
+STOP_WORDS = str(Path(__file__).resolve().parents[2] / 'stop_words.txt')
+
+REVIEWS = [
+    "Five Stars\tGreat album!!! I've listened to it 10 times... can't stop :)",
+    "It's OK.<br /><br />The 2nd track (\"Silent Night\") is the best; the rest -- meh.",
+    "DON'T BUY\tBroke after 2 days, returned it & got a refund @ $19.99 #fail",
+    "Naïve Café\tThe CD arrived on 12/24 — just in time for Christmas. Ünïcödé ÀÉÎ ß İstanbul",
+    "a\tb c d ee fff gggg\nnew line\r\nwindows\x0bvertical\x0cform feed no break em space",
+    "",
+    "   \t  \n ",
+    "!!!???...,,,",
+    "e-mail: some.one@example.com, visit http://www.example.com/path?x=1&y=2",
+    "Love it, love it, LOVE IT!!! Songs songs singing sang sung",
+]
+
+
+def sample_texts():
+    generator = random.Random(0)
+    # letters, digits, punctuation and the whitespace that splits the tokens
+    alphabet = 'abcdeXYZ019' + punctuation + ' \t\n\r\x0b\x0c  ' + 'éÜİß'
+    texts = list(REVIEWS)
+    for _ in range(500):
+        texts.append(''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 80))))
+    return texts
+
+
+@pytest.mark.parametrize('min_token_length, stop_words, language', [
+    (None, None, None),
+    (1, None, None),
+    (2, None, None),
+    (3, STOP_WORDS, None),
+    (None, STOP_WORDS, 'english'),
+    (3, STOP_WORDS, 'english'),
+])
+def test_tokenize_matches_reference(min_token_length, stop_words, language):
+    tokenizer = Tokenizer(min_token_length, stop_words, language)
+    for text in sample_texts():
+        assert tokenizer.tokenize(text) == reference_tokenize(tokenizer, text), text
+    # the second time the stems come from the cache
+    for text in sample_texts():
+        assert tokenizer.tokenize(text) == reference_tokenize(tokenizer, text), text